@@ -0,0 +1,139 @@
+import asyncio
+import json
+from typing import AsyncIterator, List, Type
+
+from fastapi import HTTPException, Request
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import Column, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import BULK_CHUNK_SIZE
+from app.models import Base
+
+# сколько разных значений полей помнит RowValidator за один запрос
+VALIDATION_CACHE_SIZE = 100000
+
+
+# проверка строки по модели pydantic, но каждое поле проверяется через ModelField.validate один раз на значение:
+# в массовой загрузке значения полей (окна доставки, регионы, веса) сильно повторяются, а полная проверка модели
+# на каждую строку стоит дороже самой вставки в бд
+# валидаторы полей не должны зависеть от других полей; строка с ошибкой проверяется моделью целиком ради текста ошибки
+class RowValidator:
+    def __init__(self, model: Type[BaseModel]):
+        self.model = model
+        self.fields = list(model.__fields__.values())
+        self.cache = {}
+
+    def __call__(self, data) -> dict:
+        if type(data) is not dict:
+            return self.model.parse_obj(data).dict()
+        row = {}
+        for field in self.fields:
+            if field.alias not in data:
+                if field.required:
+                    return self.model.parse_obj(data).dict()
+                row[field.name] = field.get_default()
+                continue
+            value = data[field.alias]
+            try:
+                key = (field.name, tuple(value) if type(value) is list else value)
+                row[field.name] = self.cache[key]
+                continue
+            except KeyError:
+                pass
+            except TypeError:  # словари и вложенные списки в значениях не кешируем
+                key = None
+            validated, errors = field.validate(value, row, loc=field.alias, cls=self.model)
+            if errors:
+                return self.model.parse_obj(data).dict()
+            if key is not None and len(self.cache) < VALIDATION_CACHE_SIZE:
+                self.cache[key] = validated
+            row[field.name] = validated
+        return row
+
+
+def _error(line_number: int, details):
+    return HTTPException(status_code=422, detail={
+        "status": "error",
+        "data": {"line": line_number},
+        "details": details
+    })
+
+
+# тело запроса в формате NDJSON (одна запись на строку) читаем по мере поступления и отдаем пачками
+async def read_ndjson_chunks(request: Request, model: Type[BaseModel],
+                             chunk_size: int = BULK_CHUNK_SIZE) -> AsyncIterator[List[dict]]:
+    validate = RowValidator(model)
+    lines = []
+    first_line = 1  # номер первой строки пачки в теле запроса
+    line_number = 0
+    buffer = b""
+
+    def parse() -> List[dict]:
+        items = [(first_line + i, line) for i, line in enumerate(lines) if line.strip()]
+        try:
+            # вся пачка одним вызовом json, при ошибке разбираем построчно, чтобы найти строку
+            data = json.loads(b"[" + b",".join(line for _, line in items) + b"]")
+        except ValueError:
+            data = []
+            for number, line in items:
+                try:
+                    data.append(json.loads(line))
+                except ValueError as error:
+                    raise _error(number, str(error))
+        rows = []
+        for (number, _), item in zip(items, data):
+            try:
+                rows.append(validate(item))
+            except ValidationError as error:
+                raise _error(number, error.errors())
+            except HTTPException as error:
+                raise _error(number, error.detail)
+        return rows
+
+    async for data in request.stream():
+        *received, buffer = (buffer + data).split(b"\n")
+        for line in received:
+            line_number += 1
+            lines.append(line)
+            if len(lines) >= chunk_size:
+                yield parse()
+                lines = []
+                first_line = line_number + 1
+    lines.append(buffer)
+    rows = parse()
+    if rows:
+        yield rows
+
+
+# пачки пишутся через COPY, без orm-объектов и в одной транзакции
+# ключи заранее берутся из последовательности таблицы, так как COPY не умеет RETURNING
+# пока бд принимает одну пачку, следующая уже читается и проверяется
+async def bulk_insert(session: AsyncSession, table: Type[Base], key: Column,
+                      chunks: AsyncIterator[List[dict]]) -> List[int]:
+    ids = []
+    connection = await session.connection()
+    driver_connection = (await connection.get_raw_connection()).driver_connection
+    sequence = func.pg_get_serial_sequence(table.__tablename__, key.name)
+    copying = None
+    try:
+        async for chunk in chunks:
+            if copying is not None:
+                await copying
+            query = select(func.array_agg(func.nextval(sequence))).select_from(func.generate_series(1, len(chunk)))
+            result = await session.execute(query)
+            chunk_ids = result.scalar_one()
+            columns = list(chunk[0])
+            copying = asyncio.ensure_future(driver_connection.copy_records_to_table(
+                table.__tablename__, columns=[key.name] + columns,
+                records=[(chunk_id, *(row[column] for column in columns)) for chunk_id, row in zip(chunk_ids, chunk)]
+            ))
+            ids.extend(chunk_ids)
+        if copying is not None:
+            await copying
+    finally:
+        # соединение нельзя вернуть, пока на нем идет COPY
+        if copying is not None and not copying.done():
+            await asyncio.wait([copying])
+    await session.commit()
+    return ids
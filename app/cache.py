@@ -0,0 +1,82 @@
+import json
+from typing import Awaitable, Callable, Optional, Type
+
+from pydantic import BaseModel
+from redis.exceptions import RedisError
+
+from app.config import CACHE_TTL
+from app.fastapi_limiter import FastAPILimiter
+from app.metrics import cache_metrics
+
+# меняется вместе с форматом записей, чтобы после выкладки не читать записи старого формата
+CACHE_SCHEMA_VERSION = 1
+
+
+# кеш поверх чтения из бд в редисе (том же, что у лимитера)
+# каждая запись хранит поколение кеша, на котором ее прочитали из бд: invalidate_all увеличивает поколение,
+# и все старые записи перестают читаться, поколение и запись читаются одним MGET
+# отсутствующие в бд записи не кешируются
+# load должен читать из основной бд: запись с отстающей реплики продержалась бы в кеше весь ttl
+# без редиса (или при его ошибках) данные читаются из бд
+class ReadThroughCache:
+    def __init__(self, name: str, model: Type[BaseModel], ttl: int = CACHE_TTL):
+        self.name = name
+        self.model = model
+        self.ttl = ttl
+        self.prefix = f"cache:{CACHE_SCHEMA_VERSION}:{name}"
+
+    def key(self, key) -> str:
+        return f"{self.prefix}:{key}"
+
+    @property
+    def generation_key(self) -> str:
+        return f"{self.prefix}:generation"
+
+    def error(self):
+        cache_metrics.errors[self.name] += 1
+
+    async def get(self, key, load: Callable[[], Awaitable[Optional[object]]]) -> Optional[object]:
+        redis = FastAPILimiter.redis
+        generation = None
+        if redis is not None:
+            try:
+                generation, cached = await redis.mget(self.generation_key, self.key(key))
+                generation = generation or "0"
+                if cached is not None:
+                    cached_generation, _, data = cached.partition(":")
+                    if cached_generation == generation:
+                        cache_metrics.hits[self.name] += 1
+                        return json.loads(data)
+            except (RedisError, OSError):
+                self.error()
+                redis = None
+        cache_metrics.misses[self.name] += 1
+
+        value = await load()
+        if value is None:
+            return None
+        value = self.model.from_orm(value)
+        if redis is not None:
+            try:
+                await redis.set(self.key(key), f"{generation}:{value.json()}", ex=self.ttl)
+            except (RedisError, OSError):
+                self.error()
+        return value
+
+    async def invalidate(self, *keys):
+        redis = FastAPILimiter.redis
+        if redis is None or not keys:
+            return
+        try:
+            await redis.delete(*(self.key(key) for key in keys))
+        except (RedisError, OSError):
+            self.error()
+
+    async def invalidate_all(self):
+        redis = FastAPILimiter.redis
+        if redis is None:
+            return
+        try:
+            await redis.incr(self.generation_key)
+        except (RedisError, OSError):
+            self.error()
@@ -12,6 +12,48 @@ REDIS_HOST = os.environ.get("REDIS_HOST")
 REDIS_PORT = os.environ.get("REDIS_PORT")
 REDIS_PASSWORD = os.environ.get("REDIS_PASSWORD")
 
+# число процессов для параллельного распределения заказов
+ASSIGN_WORKERS = int(os.environ.get("ASSIGN_WORKERS") or os.cpu_count() or 1)
+# где считать план распределения: thread, process или inline (прямо в обработчике)
+ASSIGN_EXECUTOR = os.environ.get("ASSIGN_EXECUTOR", "thread")
+# верхняя граница ?budget_ms для улучшения плана распределения
+MAX_IMPROVEMENT_BUDGET_MS = int(os.environ.get("MAX_IMPROVEMENT_BUDGET_MS") or 5000)
+# строк в одной пачке при массовой загрузке курьеров и заказов
+BULK_CHUNK_SIZE = int(os.environ.get("BULK_CHUNK_SIZE") or 5000)
+
+# пул соединений с бд, по умолчанию как в sqlalchemy
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE") or 5)
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW") or 10)
+# сколько секунд запрос ждет свободное соединение
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT") or 30)
+# через сколько секунд соединение пересоздается, -1 - никогда
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE") or -1)
+# проверять соединение перед выдачей из пула
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "").lower() in ("1", "true", "yes")
+# подготовленных запросов asyncpg на одно соединение, 0 - не кешировать
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 100))
+
+# реплика для чтения, без DB_READ_HOST все запросы идут в основную бд
+DB_READ_HOST = os.environ.get("DB_READ_HOST")
+DB_READ_PORT = os.environ.get("DB_READ_PORT") or DB_PORT
+# допустимое отставание реплики в секундах, при большем чтение идет в основную бд
+DB_READ_MAX_LAG = float(os.environ.get("DB_READ_MAX_LAG") or 5)
+# как часто проверять отставание реплики
+DB_READ_LAG_CHECK_INTERVAL = float(os.environ.get("DB_READ_LAG_CHECK_INTERVAL") or 1)
+# через сколько секунд снова пробовать недоступную или отставшую реплику
+DB_READ_RETRY_INTERVAL = float(os.environ.get("DB_READ_RETRY_INTERVAL") or 30)
+DB_READ_CONNECT_TIMEOUT = float(os.environ.get("DB_READ_CONNECT_TIMEOUT") or 2)
+
+# объединять одинаковые одновременные чтения списков в один запрос к бд (SingleFlight)
+SINGLE_FLIGHT = os.environ.get("SINGLE_FLIGHT", "").lower() in ("1", "true", "yes")
+
+# время жизни записей кеша курьеров и заказов в редисе, в секундах
+CACHE_TTL = int(os.environ.get("CACHE_TTL") or 60)
+
+# больше смен кеш курьеров для распределения не хранит (заготовка смены - около 200 байт),
+# такой состав читается из бд на каждое распределение
+ROSTER_CACHE_MAX_SHIFTS = int(os.environ.get("ROSTER_CACHE_MAX_SHIFTS") or 200000)
+
 DB_HOST_TEST = os.environ.get("DB_HOST_TEST")
 DB_PORT_TEST = os.environ.get("DB_PORT_TEST")
 DB_NAME_TEST = os.environ.get("DB_NAME_TEST")
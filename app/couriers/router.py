@@ -1,15 +1,34 @@
-from datetime import date, timedelta, datetime
+from datetime import date, timedelta
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select, func
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select, func, insert, case, literal, any_, Integer, Numeric
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
-from app.models import couriers, delivery, orders, CourierCoefficients, orders_assignments
-from app.couriers.schemas import CourierDto, CreateCourierRequest, CreateCouriersResponse, GetOrderAssignmentResponse
-from app.couriers.schemas import GetCouriersResponse, GetCourierMetaInfoResponse
-from app.database import get_async_session
+from app.models import couriers, delivery, CourierCoefficients, Couriers_Types, orders_assignments, \
+    courier_daily_stats, parse_hours
+from app.bulk import bulk_insert, read_ndjson_chunks
+from app.cache import ReadThroughCache
+from app.couriers.schemas import CourierDto, CreateCourierRequest, CreateCouriersResponse, GetOrderAssignmentResponse, \
+    CreateCourierDto, CreateCouriersBulkResponse
+from app.couriers.schemas import GetCouriersResponse, GetCourierMetaInfoResponse, GetCouriersLeaderboardResponse, \
+    LeaderboardSortBy
+from app.database import get_async_session, get_read_session
+from app.etag import ETag
+from app.export import ndjson_response
 from app.fastapi_limiter.depends import RateLimiter
+from app.orders.roster import roster_cache
+from app.pagination import next_cursor, paginate
+from app.singleflight import SingleFlight
+
+courier_cache = ReadThroughCache("courier", CourierDto)
+couriers_flight = SingleFlight("couriers")
+assignments_flight = SingleFlight("assignments")
+meta_info_flight = SingleFlight("meta-info")
+leaderboard_flight = SingleFlight("leaderboard")
 
 router = APIRouter(
     prefix="/couriers",
@@ -28,18 +47,80 @@ def last_day_of_month(any_day):
     return next_month - timedelta(days=next_month.day)
 
 
-# получение одного курьера
+# рейтинг и заработок сразу многих курьеров (по списку courier_ids или всех) одним сгруппированным запросом,
+# коэффициенты те же, что в meta-info; курьеры без выполненных заказов за период идут в конце
+@router.get(
+    "/leaderboard",
+    status_code=status.HTTP_200_OK,
+    name="Couriers leaderboard",
+    response_model=GetCouriersLeaderboardResponse
+)
+async def get_couriers_leaderboard(
+        start_date: date = first_day_of_month(date.today()),
+        end_date: date = last_day_of_month(date.today()),
+        courier_ids: Optional[List[int]] = Query(None),
+        sort_by: LeaderboardSortBy = LeaderboardSortBy.rating,
+        limit: Optional[int] = Query(None, ge=1),
+        session: AsyncSession = Depends(get_read_session)
+):
+    stats = select(courier_daily_stats.courier_id,
+                   func.sum(courier_daily_stats.orders_count).label("orders_count"),
+                   func.sum(courier_daily_stats.orders_cost).label("orders_cost")). \
+        filter(courier_daily_stats.stat_date.between(start_date, end_date)). \
+        group_by(courier_daily_stats.courier_id).subquery()
+
+    # часы работы считаются как в get_working_hours_count: разница часов начала и конца каждого интервала
+    working_hours = func.unnest(couriers.working_hours).table_valued("value").render_derived(name="working_hours")
+    hours = select(func.sum(
+        func.split_part(func.split_part(working_hours.c.value, "-", 2), ":", 1).cast(Integer) -
+        func.split_part(working_hours.c.value, ":", 1).cast(Integer)
+    )).select_from(working_hours).scalar_subquery()
+    hours_count = (hours * (end_date - start_date).days).label("hours_count")
+
+    coefficients = {courier_type.value: CourierCoefficients(courier_type) for courier_type in Couriers_Types}
+    earnings_coeff = case({key: value.earnings_coeff for key, value in coefficients.items()},
+                          value=couriers.courier_type, else_=0)
+    rating_coeff = case({key: value.rating_coeff for key, value in coefficients.items()},
+                        value=couriers.courier_type, else_=0)
+    columns = {
+        LeaderboardSortBy.orders_count: stats.c.orders_count,
+        LeaderboardSortBy.orders_cost: stats.c.orders_cost,
+        LeaderboardSortBy.earnings: (stats.c.orders_cost * earnings_coeff).label("earnings"),
+        LeaderboardSortBy.rating: func.round(
+            stats.c.orders_count.cast(Numeric) / func.nullif(hours_count.element, 0) * rating_coeff, 4
+        ).label("rating"),
+    }
+
+    query = select(couriers.courier_id, couriers.courier_type, hours_count, *columns.values()). \
+        outerjoin(stats, stats.c.courier_id == couriers.courier_id). \
+        order_by(columns[sort_by].desc().nullslast(), couriers.courier_id). \
+        limit(limit)
+    if courier_ids is not None:
+        query = query.filter(couriers.courier_id == any_(literal(courier_ids, ARRAY(Integer))))
+
+    async def load():
+        result = await session.execute(query)
+        return result.mappings().all()
+
+    key = (start_date, end_date, courier_ids and tuple(courier_ids), sort_by, limit)
+    return {"start_date": start_date, "end_date": end_date, "couriers": await leaderboard_flight.do(key, load)}
+
+
+# получение одного курьера, промах кеша читается из основной бд
 @router.get(
     "/{courier_id}",
     response_model=CourierDto
 )
 async def get_specific_courier(courier_id: int, session: AsyncSession = Depends(get_async_session)):
-    try:
+    async def load():
         query = select(couriers).filter(couriers.courier_id == courier_id)
         result = await session.execute(query)
         courier_row = result.fetchone()
         if courier_row is not None:
             return courier_row[0]
+
+    try:
+        return await courier_cache.get(courier_id, load)
     except Exception:
         # Передать ошибку разработчикам
         raise HTTPException(status_code=500, detail={
@@ -53,12 +134,19 @@ async def get_specific_courier(courier_id: int, session: AsyncSession = Depends(
 @router.get(
     "/",
     status_code=status.HTTP_200_OK,
-    response_model=GetCouriersResponse
+    response_model=GetCouriersResponse,
+    dependencies=[Depends(ETag("couriers"))]
 )
-async def get_couriers(session: AsyncSession = Depends(get_async_session), offset: int = 0, limit: int = 1):
-    query = select(couriers).limit(limit).offset(offset)
-    result = await session.execute(query)
-    body_response = {"couriers": [r for r, in result], "limit": limit, "offset": offset}
+async def get_couriers(session: AsyncSession = Depends(get_read_session), offset: int = 0, limit: int = 1,
+                       cursor: Optional[str] = None):
+    async def load():
+        query = paginate(select(couriers), couriers.courier_id, limit, offset, cursor)
+        result = await session.execute(query)
+        return [r for r, in result]
+
+    couriers_data = await couriers_flight.do((offset, limit, cursor), load)
+    body_response = {"couriers": couriers_data, "limit": limit, "offset": offset,
+                     "next_cursor": next_cursor([c.courier_id for c in couriers_data], limit)}
     return body_response
 
 
@@ -68,12 +156,32 @@ async def get_couriers(session: AsyncSession = Depends(get_async_session), offse
     response_model=CreateCouriersResponse
 )
 async def add_couriers(new_couriers: CreateCourierRequest, session: AsyncSession = Depends(get_async_session)):
-    couriers_data = [couriers(**i.dict()) for i in new_couriers.couriers]
-    session.add_all(couriers_data)
+    couriers_data = []
+    if new_couriers.couriers:
+        query = insert(couriers.__table__).returning(*couriers.__table__.c, sort_by_parameter_order=True)
+        result = await session.execute(query, [i.dict() for i in new_couriers.couriers])
+        couriers_data = result.all()
     await session.commit()
+    roster_cache.invalidate()
+    await courier_cache.invalidate(*(courier.courier_id for courier in couriers_data))
     return {"couriers": couriers_data}
 
 
+# массовая загрузка курьеров: тело в формате NDJSON, по одному курьеру CreateCourierDto на строку
+@router.post(
+    "/bulk",
+    status_code=status.HTTP_200_OK,
+    response_model=CreateCouriersBulkResponse
+)
+async def add_couriers_bulk(request: Request, session: AsyncSession = Depends(get_async_session)):
+    courier_ids = await bulk_insert(session, couriers, couriers.courier_id,
+                                    read_ndjson_chunks(request, CreateCourierDto))
+    roster_cache.invalidate()
+    await courier_cache.invalidate_all()
+    # список ключей отдаем без проверки response_model, на сотнях тысяч строк она дороже самой загрузки
+    return JSONResponse({"courier_ids": courier_ids})
+
+
 # получение рейтинга курьера
 @router.get(
     "/meta-info/{courier_id}",
@@ -85,49 +193,11 @@ async def get_courier_meta_info(
         courier_id: int,
         start_date: date = first_day_of_month(date.today()),
         end_date: date = last_day_of_month(date.today()),
-        session: AsyncSession = Depends(get_async_session)
+        session: AsyncSession = Depends(get_read_session)
 ):
     try:
-        # query = select(func.sum(orders.cost).label("cost"), func.count(orders.order_id).label("count")). \
-        #     filter(orders.completed_time.isnot(None)). \
-        #     filter(orders.order_id.in_(select(delivery.order_id).filter(delivery.courier_id == courier_id). \
-        #                                filter(delivery.delivery_date.between(start_date, end_date))
-        #                                )
-        #            )
-        query = select(func.sum(orders.cost).label("cost"), func.count(orders.order_id).label("count")). \
-            filter(orders.completed_time.isnot(None)). \
-            filter(orders.order_id.in_(select(func.unnest(orders_assignments.orders)). \
-                                       filter(orders_assignments.courier_id == courier_id)
-                                       ))
-        result = await session.execute(query)
-        data_row = result.fetchone()
-        if data_row[0] is not None:
-            query = select(couriers.courier_type, couriers.working_hours).filter(couriers.courier_id == courier_id)
-            result = await session.execute(query)
-            courier_data_from_db = result.fetchone()
-
-            courier_type_from_db, working_hours_from_db = (courier_data_from_db)
-            coefficients = CourierCoefficients(courier_type_from_db)
-            diff_days = (end_date - start_date).days
-            diff_hours = get_working_hours_count(working_hours_from_db)
-            hours_by_period = diff_hours * diff_days
-            return {
-                "start_date": start_date,
-                "end_date": end_date,
-                "courier_id": courier_id,
-                "courier_type": courier_type_from_db,
-                "orders_count": data_row.count,
-                "orders_cost": data_row.cost,
-                "hours_count": hours_by_period,
-                "earnings": data_row.cost * coefficients.earnings_coeff,
-                "rating": round((data_row.count / hours_by_period) * coefficients.rating_coeff, 4)
-            }
-        else:
-            return {
-                "start_date": start_date,
-                "end_date": end_date,
-                "courier_id": courier_id
-            }
+        return await meta_info_flight.do((courier_id, start_date, end_date),
+                                         lambda: load_meta_info(session, courier_id, start_date, end_date))
     except Exception:
         # Передать ошибку разработчикам
         raise HTTPException(status_code=500, detail={
@@ -137,24 +207,80 @@ async def get_courier_meta_info(
         })
 
 
+async def load_meta_info(session: AsyncSession, courier_id: int, start_date: date, end_date: date) -> dict:
+    # суммы по дням ведутся при выполнении заказов, на период не больше строки на каждый день
+    query = select(func.sum(courier_daily_stats.orders_cost).label("cost"),
+                   func.sum(courier_daily_stats.orders_count).label("count")). \
+        filter(courier_daily_stats.courier_id == courier_id,
+               courier_daily_stats.stat_date.between(start_date, end_date))
+    result = await session.execute(query)
+    data_row = result.fetchone()
+    if data_row[0] is not None:
+        query = select(couriers.courier_type, couriers.working_hours).filter(couriers.courier_id == courier_id)
+        result = await session.execute(query)
+        courier_data_from_db = result.fetchone()
+
+        courier_type_from_db, working_hours_from_db = (courier_data_from_db)
+        coefficients = CourierCoefficients(courier_type_from_db)
+        diff_days = (end_date - start_date).days
+        diff_hours = get_working_hours_count(working_hours_from_db)
+        hours_by_period = diff_hours * diff_days
+        return {
+            "start_date": start_date,
+            "end_date": end_date,
+            "courier_id": courier_id,
+            "courier_type": courier_type_from_db,
+            "orders_count": data_row.count,
+            "orders_cost": data_row.cost,
+            "hours_count": hours_by_period,
+            "earnings": data_row.cost * coefficients.earnings_coeff,
+            "rating": round((data_row.count / hours_by_period) * coefficients.rating_coeff, 4)
+        }
+    else:
+        return {
+            "start_date": start_date,
+            "end_date": end_date,
+            "courier_id": courier_id
+        }
+
+
 def get_working_hours_count(working_hours: list) -> int:
     result = 0
     for turn in working_hours:
-        start_time = datetime.strptime(turn[:5], '%H:%M').time()
-        end_time = datetime.strptime(turn[6:], '%H:%M').time()
-        delta = end_time.hour - start_time.hour
+        start_time, end_time = parse_hours(turn)
+        delta = end_time // 60 - start_time // 60
         result += delta
     return result
 
 
+# выгрузка распределенных заказов в NDJSON, можно отфильтровать по дате
+@router.get(
+    "/assignments/export",
+    response_class=StreamingResponse,
+    name="Orders assignments export"
+)
+async def export_orders_assignment(request: Request, delivery_date: Optional[date] = None):
+    query = select(*orders_assignments.__table__.c)
+    if delivery_date is not None:
+        query = query.filter(orders_assignments.delivery_date == delivery_date)
+    return ndjson_response(request.app, query, orders_assignments.assignments_id)
+
+
 # получение списка распределенных заказов
 @router.get(
     "/assignments/",
     status_code=status.HTTP_200_OK,
-    response_model=GetOrderAssignmentResponse
+    response_model=GetOrderAssignmentResponse,
+    dependencies=[Depends(ETag("orders_assignments"))]
 )
-async def get_orders_assignment(session: AsyncSession = Depends(get_async_session), offset: int = 0, limit: int = 1):
-    query = select(orders_assignments).limit(limit).offset(offset)
-    result = await session.execute(query)
-    body_response = {"orders_assignment": [r for r, in result], "limit": limit, "offset": offset}
+async def get_orders_assignment(session: AsyncSession = Depends(get_read_session), offset: int = 0, limit: int = 1,
+                                cursor: Optional[str] = None):
+    async def load():
+        query = paginate(select(orders_assignments), orders_assignments.assignments_id, limit, offset, cursor)
+        result = await session.execute(query)
+        return [r for r, in result]
+
+    assignments_data = await assignments_flight.do((offset, limit, cursor), load)
+    body_response = {"orders_assignment": assignments_data, "limit": limit, "offset": offset,
+                     "next_cursor": next_cursor([a.assignments_id for a in assignments_data], limit)}
     return body_response
@@ -1,3 +1,4 @@
+from enum import Enum
 from typing import List, Optional
 
 from fastapi import HTTPException
@@ -38,6 +39,10 @@ class CreateCourierRequest(BaseModel):
     couriers: List[CreateCourierDto]
 
 
+class CreateCouriersBulkResponse(BaseModel):
+    courier_ids: List[int]
+
+
 class GetCourierMetaInfoResponse(BaseModel):
     start_date: date
     end_date: date
@@ -50,6 +55,29 @@ class GetCourierMetaInfoResponse(BaseModel):
     earnings: Optional[float]
 
 
+class LeaderboardSortBy(str, Enum):
+    rating = "rating"
+    earnings = "earnings"
+    orders_count = "orders_count"
+    orders_cost = "orders_cost"
+
+
+class CourierRatingDto(BaseModel):
+    courier_id: int
+    courier_type: Couriers_Types
+    orders_count: Optional[int]
+    orders_cost: Optional[int]
+    hours_count: Optional[int]
+    rating: Optional[float]
+    earnings: Optional[float]
+
+
+class GetCouriersLeaderboardResponse(BaseModel):
+    start_date: date
+    end_date: date
+    couriers: List[CourierRatingDto]
+
+
 class CreateCouriersResponse(OurBaseModel):
     couriers: List[CourierDto]
 
@@ -58,9 +86,11 @@ class GetCouriersResponse(BaseModel):
     couriers: List[CourierDto]
     limit: int
     offset: int
+    next_cursor: Optional[str]
 
 
 class GetOrderAssignmentResponse(BaseModel):
     orders_assignment: List[OrderAssignmentResponse]
     limit: int
-    offset: int
\ No newline at end of file
+    offset: int
+    next_cursor: Optional[str]
@@ -1,12 +1,20 @@
 
 
-from typing import AsyncGenerator
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Awaitable, Callable, Optional
 
-from sqlalchemy import MetaData
+from fastapi import Depends
+from sqlalchemy import MetaData, event, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from app.config import DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER
+from sqlalchemy.orm import Session, sessionmaker
+from app.config import DB_HOST, DB_NAME, DB_PASS, DB_PORT, DB_USER, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, \
+    DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_CACHE_SIZE, DB_READ_HOST, DB_READ_PORT, DB_READ_MAX_LAG, \
+    DB_READ_LAG_CHECK_INTERVAL, DB_READ_RETRY_INTERVAL, DB_READ_CONNECT_TIMEOUT
+from app.metrics import InstrumentedPool, instrument, pool_metrics
 
 import os
 import sys
@@ -16,15 +24,144 @@ sys.path.append(os.path.join(sys.path[0], 'app'))
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 Base = declarative_base()
 
-engine = create_async_engine(DATABASE_URL)
+def make_engine(url: str, **connect_args):
+    result = create_async_engine(
+        url,
+        poolclass=InstrumentedPool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args={"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE, **connect_args}
+    )
+    instrument(result)
+    return result
+
+
+engine = make_engine(DATABASE_URL)
 async_session_maker = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 metadata = Base.metadata
 metadata.bind = engine
 
+# сессия становится использованной, когда берет соединение из пула
+@event.listens_for(Session, "after_begin")
+def _mark_checkout(session, transaction, connection):
+    session.info["checked_out"] = True
+
+
+# сессия для обработчиков: AsyncSession создается при первом обращении, соединение берется при первом запросе;
+# с release_after_execute соединение возвращается в пул сразу после каждого запроса, а не после отправки ответа;
+# open_session вызывается при первом execute и может вернуть другую сессию (реплику), при None - основная бд
+class LazySession:
+    def __init__(self, session_maker: Callable[[], AsyncSession], release_after_execute: bool = False,
+                 open_session: Optional[Callable[[], Awaitable[Optional[AsyncSession]]]] = None):
+        self._session_maker = session_maker
+        self._session: Optional[AsyncSession] = None
+        self.release_after_execute = release_after_execute
+        self.open_session = open_session
+
+    @property
+    def session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self._session_maker()
+        return self._session
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    async def execute(self, *args, **kwargs):
+        if self._session is None and self.open_session is not None:
+            self._session = await self.open_session()
+        result = await self.session.execute(*args, **kwargs)
+        if self.release_after_execute:
+            # результат AsyncSession уже прочитан целиком, загруженные объекты после close остаются доступны
+            await self.session.close()
+        return result
+
+    async def close(self):
+        pool_metrics.sessions += 1
+        if self._session is None or not self._session.info.get("checked_out"):
+            pool_metrics.sessions_without_checkout += 1
+        if self._session is not None:
+            await self._session.close()
+
+
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
-    async with async_session_maker() as session:
+    session = LazySession(async_session_maker)
+    try:
         yield session
+    finally:
+        await session.close()
+
+
+# отставание реплики в секундах; реплика, которая проиграла все полученные изменения, не отстает,
+# даже если в основную бд давно ничего не писали
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+# реплика для чтения: отставание проверяется не чаще DB_READ_LAG_CHECK_INTERVAL,
+# недоступная или отставшая реплика не используется DB_READ_RETRY_INTERVAL секунд
+class ReadReplica:
+    def __init__(self, session_maker: sessionmaker, max_lag: float = DB_READ_MAX_LAG):
+        self.session_maker = session_maker
+        self.max_lag = max_lag
+        self.usable = True
+        self.checked_at = float("-inf")
+        self.retry_at = float("-inf")
+
+    async def session(self) -> Optional[AsyncSession]:
+        now = time.monotonic()
+        if not self.usable and now < self.retry_at:
+            return None
+        session = self.session_maker()
+        try:
+            if not self.usable or now - self.checked_at >= DB_READ_LAG_CHECK_INTERVAL:
+                lag = (await session.execute(REPLICA_LAG_QUERY)).scalar()
+                self.checked_at = now
+                self.usable = lag <= self.max_lag
+            else:
+                await session.connection()
+        except (OSError, asyncio.TimeoutError, DBAPIError):
+            self.usable = False
+        if not self.usable:
+            self.retry_at = now + DB_READ_RETRY_INTERVAL
+            await session.close()
+            return None
+        return session
+
+
+read_replica = None
+if DB_READ_HOST:
+    read_engine = make_engine(f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_READ_HOST}:{DB_READ_PORT}/{DB_NAME}",
+                              timeout=DB_READ_CONNECT_TIMEOUT)
+    read_replica = ReadReplica(sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False))
+
+
+# сессия для обработчиков, которые только читают: реплика, если она настроена, доступна и не отстает,
+# иначе основная бд; реплика выбирается при первом запросе, так что обработчик без запросов соединение не берет,
+# а сессию реплики закрывает get_async_session вместе с ленивой сессией
+async def get_read_session(session: LazySession = Depends(get_async_session)) -> AsyncGenerator[AsyncSession, None]:
+    session.release_after_execute = True
+    if read_replica is not None:
+        session.open_session = read_replica.session
+    yield session
+
+
+# сессия для фоновых задач из того же источника, что и у обработчиков (с учетом dependency_overrides)
+@asynccontextmanager
+async def background_session(app) -> AsyncGenerator[AsyncSession, None]:
+    sessions = app.dependency_overrides.get(get_async_session, get_async_session)()
+    try:
+        yield await sessions.__anext__()
+    finally:
+        await sessions.aclose()
 
 async def prepare_database():
     async with engine.begin() as conn:
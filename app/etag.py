@@ -0,0 +1,40 @@
+import hashlib
+from typing import Tuple
+
+from fastapi import Depends, HTTPException, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from app.database import get_read_session
+from app.models import table_versions
+
+
+async def get_table_versions(session: AsyncSession, tables: Tuple[str, ...]) -> Tuple[int, ...]:
+    query = select(table_versions.table_name, table_versions.version).filter(table_versions.table_name.in_(tables))
+    result = await session.execute(query)
+    versions = dict(result.all())
+    return tuple(versions.get(table, 0) for table in tables)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+# зависимость для списков: ETag строится по версиям таблиц и параметрам запроса без чтения строк,
+# при совпадении с If-None-Match ответ 304 отдается до запроса списка и проверки response_model
+class ETag:
+    def __init__(self, *tables: str):
+        self.tables = tables
+
+    async def __call__(self, request: Request, response: Response,
+                       session: AsyncSession = Depends(get_read_session)):
+        versions = await get_table_versions(session, self.tables)
+        key = f"{request.url.path}?{request.url.query}:{versions}"
+        etag = f'"{hashlib.sha1(key.encode()).hexdigest()}"'
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match is not None and etag_matches(if_none_match, etag):
+            raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        response.headers["ETag"] = etag
@@ -0,0 +1,29 @@
+from typing import AsyncIterator
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Column, Select, Text, func, select
+
+from app.database import background_session
+
+# строк, которые читаются из серверного курсора за раз
+EXPORT_CHUNK_SIZE = 1000
+
+
+# строки запроса читаются серверным курсором пачками и сразу уходят клиенту в NDJSON,
+# поэтому память не зависит от размера таблицы, а первые строки отдаются до окончания выборки
+# json собирает сам postgres (row_to_json), в python остается только склеить строки
+# у потока своя сессия: сессия обработчика может закрыться раньше, чем ответ будет отправлен
+async def stream_ndjson(app: FastAPI, query: Select, key: Column,
+                        chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    rows = query.subquery("row")
+    query = select(func.row_to_json(rows.table_valued()).cast(Text)).order_by(rows.c[key.name])
+    async with background_session(app) as session:
+        connection = await session.connection()
+        result = await connection.stream(query.execution_options(yield_per=chunk_size))
+        async for lines in result.scalars().partitions():
+            yield ("\n".join(lines) + "\n").encode()
+
+
+def ndjson_response(app: FastAPI, query: Select, key: Column) -> StreamingResponse:
+    return StreamingResponse(stream_ndjson(app, query, key), media_type="application/x-ndjson")
@@ -1,4 +1,4 @@
-from typing import Callable, Optional
+from typing import Callable, Dict, Optional, Tuple
 
 from pydantic import conint
 from starlette.requests import Request
@@ -23,6 +23,7 @@ class RateLimiter:
         self.milliseconds = milliseconds + 1000 * seconds + 60000 * minutes + 3600000 * hours
         self.identifier = identifier
         self.callback = callback
+        self._route_keys: Dict[int, Tuple[object, Tuple[int, int]]] = {}
 
     async def _check(self, key):
         redis = FastAPILimiter.redis
@@ -31,9 +32,21 @@ class RateLimiter:
         )
         return pexpire
 
-    async def __call__(self, request: Request, response: Response):
-        if not FastAPILimiter.redis:
-            raise Exception("You must call FastAPILimiter.init in startup event of fastapi!")
+    # route and dependency indexes for the key, resolved once per matched route object
+    def _route_key(self, request: Request) -> Tuple[int, int]:
+        route = request.scope.get("route")
+        if route is None:
+            return self._scan(request)
+        cached = self._route_keys.get(id(route))
+        if cached is not None and cached[0] is route:
+            return cached[1]
+        route_index = next((i for i, item in enumerate(request.app.routes) if item is route), 0)
+        dep_index = next((j for j, dependency in enumerate(route.dependencies) if self is dependency.dependency), 0)
+        self._route_keys[id(route)] = (route, (route_index, dep_index))
+        return route_index, dep_index
+
+    # without a matched route in scope (not an APIRoute) fall back to scanning all routes by path
+    def _scan(self, request: Request) -> Tuple[int, int]:
         route_index = 0
         dep_index = 0
         for i, route in enumerate(request.app.routes):
@@ -43,6 +56,12 @@ class RateLimiter:
                     if self is dependency.dependency:
                         dep_index = j
                         break
+        return route_index, dep_index
+
+    async def __call__(self, request: Request, response: Response):
+        if not FastAPILimiter.redis:
+            raise Exception("You must call FastAPILimiter.init in startup event of fastapi!")
+        route_index, dep_index = self._route_key(request)
 
         # moved here because constructor run before app startup
         identifier = self.identifier or FastAPILimiter.identifier
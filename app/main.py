@@ -5,6 +5,7 @@ from app.fastapi_limiter import FastAPILimiter
 from app.router import router
 from app.couriers.router import router as router_courier
 from app.orders.router import router as router_order
+from app.orders import executor
 from fastapi import FastAPI
 from app.config import REDIS_HOST
 
@@ -29,4 +30,9 @@ async def startup():
     # нужен редис из докер композ чтобы это работало
     redis = redisac.from_url(f"redis://{REDIS_HOST}", encoding="utf-8", decode_responses=True)
     await FastAPILimiter.init(redis)
-    prepare_database()
\ No newline at end of file
+    prepare_database()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    executor.shutdown()
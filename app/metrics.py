@@ -0,0 +1,153 @@
+import time
+from collections import defaultdict
+from typing import List, Sequence
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.util import LRUCache
+
+# границы корзин гистограммы ожидания соединения, в секундах
+CHECKOUT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = list(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    # в формате prometheus корзины накопительные
+    def lines(self, name: str) -> List[str]:
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append(f'{name}_bucket{{le="{bound}"}} {total}')
+        result.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        result.append(f"{name}_sum {self.sum}")
+        result.append(f"{name}_count {self.count}")
+        return result
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.waiting = 0
+        self.timeouts = 0
+        self.checkout = Histogram(CHECKOUT_BUCKETS)
+        self.statements_hits = 0
+        self.statements_misses = 0
+        # сессии обработчиков, в том числе не взявшие соединение из пула
+        self.sessions = 0
+        self.sessions_without_checkout = 0
+
+
+pool_metrics = PoolMetrics()
+
+
+# обращения к кешам по имени кеша
+class CacheMetrics:
+    def __init__(self):
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.entries = {}
+
+
+cache_metrics = CacheMetrics()
+
+
+# чтения через SingleFlight по имени: выполненные и присоединившиеся к уже идущему
+class SingleFlightMetrics:
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self.coalesced = defaultdict(int)
+
+
+single_flight_metrics = SingleFlightMetrics()
+
+
+# пул, который считает ожидающих соединение и время выдачи соединения (вместе с созданием и pre-ping)
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    def connect(self):
+        pool_metrics.waiting += 1
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except TimeoutError:
+            pool_metrics.timeouts += 1
+            raise
+        finally:
+            pool_metrics.waiting -= 1
+            pool_metrics.checkout.observe(time.perf_counter() - started)
+
+
+# кеш подготовленных запросов соединения asyncpg: sqlalchemy проверяет в нем запрос перед prepare
+class StatementCache(LRUCache):
+    __slots__ = ()
+
+    def __contains__(self, key) -> bool:
+        found = super().__contains__(key)
+        if found:
+            pool_metrics.statements_hits += 1
+        else:
+            pool_metrics.statements_misses += 1
+        return found
+
+
+def _on_connect(dbapi_connection, connection_record):
+    cache = getattr(dbapi_connection, "_prepared_statement_cache", None)
+    if cache is not None:
+        dbapi_connection._prepared_statement_cache = StatementCache(cache.capacity)
+
+
+def instrument(engine: AsyncEngine):
+    event.listen(engine.sync_engine, "connect", _on_connect)
+
+
+def render(engine: AsyncEngine) -> str:
+    lines = []
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        lines += [
+            f"db_pool_size {pool.size()}",
+            f"db_pool_checked_out {pool.checkedout()}",
+            f"db_pool_checked_in {pool.checkedin()}",
+            f"db_pool_overflow {pool.overflow()}",
+        ]
+    lookups = pool_metrics.statements_hits + pool_metrics.statements_misses
+    lines += [
+        f"db_pool_waiting {pool_metrics.waiting}",
+        f"db_pool_checkout_timeouts_total {pool_metrics.timeouts}",
+        "# TYPE db_pool_checkout_seconds histogram",
+        *pool_metrics.checkout.lines("db_pool_checkout_seconds"),
+        f"db_statement_cache_hits_total {pool_metrics.statements_hits}",
+        f"db_statement_cache_misses_total {pool_metrics.statements_misses}",
+        f"db_statement_cache_hit_ratio {pool_metrics.statements_hits / lookups if lookups else 0}",
+        f"db_sessions_total {pool_metrics.sessions}",
+        f"db_sessions_without_checkout_total {pool_metrics.sessions_without_checkout}",
+    ]
+    for name in sorted(set(cache_metrics.hits) | set(cache_metrics.misses) | set(cache_metrics.errors)):
+        lines += [
+            f'cache_hits_total{{cache="{name}"}} {cache_metrics.hits[name]}',
+            f'cache_misses_total{{cache="{name}"}} {cache_metrics.misses[name]}',
+            f'cache_errors_total{{cache="{name}"}} {cache_metrics.errors[name]}',
+        ]
+        if name in cache_metrics.entries:
+            lines.append(f'cache_entries{{cache="{name}"}} {cache_metrics.entries[name]}')
+    for name in sorted(single_flight_metrics.calls):
+        lines += [
+            f'singleflight_calls_total{{name="{name}"}} {single_flight_metrics.calls[name]}',
+            f'singleflight_coalesced_total{{name="{name}"}} {single_flight_metrics.coalesced[name]}',
+        ]
+    return "\n".join(lines) + "\n"
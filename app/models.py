@@ -1,15 +1,18 @@
 from dataclasses import dataclass, field
-from datetime import datetime, date, timedelta, time
+from datetime import time
+from functools import lru_cache
 import re
 from enum import Enum
-from typing import List
+from typing import List, Optional, Tuple
 
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, String, Integer, Float, ForeignKey, Date, Time
+from sqlalchemy import Column, String, Integer, BigInteger, Float, ForeignKey, Date, Time, Boolean, Index, DDL, event
 from sqlalchemy.dialects.postgresql import ARRAY
 
 Base = declarative_base()
 
+MINUTES_PER_DAY = 24 * 60
+
 hours_pattern = re.compile(r"^([0-1]?[0-9]|2[0-3]):[0-5][0-9]-([0-1]?[0-9]|2[0-3]):[0-5][0-9]$")
 
 
@@ -53,6 +56,173 @@ class orders_assignments(Base):
     regions = Column(ARRAY(Integer), nullable=False)
     orders = Column(ARRAY(Integer), nullable=False)
 
+    __table_args__ = (
+        Index('ix_orders_assignments_delivery_date', 'delivery_date'),
+    )
+
+
+# заказы туров построчно, по ним ищутся распределенные заказы вместо unnest(orders_assignments.orders)
+class assignment_orders(Base):
+    __tablename__ = 'assignment_orders'
+    assignments_id = Column(Integer, ForeignKey(orders_assignments.assignments_id, ondelete='CASCADE'),
+                            primary_key=True)
+    order_id = Column(Integer, ForeignKey(orders.order_id), primary_key=True)
+    courier_id = Column(Integer, ForeignKey(couriers.courier_id), nullable=False)
+    delivery_date = Column(Date, nullable=False)
+
+    __table_args__ = (
+        Index('ix_assignment_orders_order_id', 'order_id'),
+        Index('ix_assignment_orders_courier_id_delivery_date', 'courier_id', 'delivery_date'),
+    )
+
+
+# выполненные заказы курьера по дням доставки, обновляются вместе с отметкой о выполнении
+class courier_daily_stats(Base):
+    __tablename__ = 'courier_daily_stats'
+    courier_id = Column(Integer, ForeignKey(couriers.courier_id), primary_key=True)
+    stat_date = Column(Date, primary_key=True)
+    orders_count = Column(Integer, nullable=False, default=0)
+    orders_cost = Column(Integer, nullable=False, default=0)
+
+
+# состояние смены курьера на дату для инкрементального распределения
+class courier_shifts(Base):
+    __tablename__ = 'courier_shifts'
+    shift_id = Column(Integer, primary_key=True)
+    courier_id = Column(Integer, ForeignKey(couriers.courier_id), nullable=False)
+    courier_type = Column(String, nullable=False)
+    delivery_date = Column(Date, nullable=False)
+    working_hours = Column(String, nullable=False)
+    regions = Column(ARRAY(Integer), nullable=False)
+    start_time = Column(Integer, nullable=False)  # минуты от начала суток
+    available_load = Column(Float, nullable=False)
+    available_regions = Column(Integer, nullable=False)
+    available_orders = Column(Integer, nullable=False)
+    is_loaded = Column(Boolean, nullable=False, default=False)
+    # открытый тур смены, в него дописываются новые заказы
+    assignments_id = Column(Integer, ForeignKey(orders_assignments.assignments_id), nullable=True)
+
+    __table_args__ = (
+        Index('ix_courier_shifts_delivery_date', 'delivery_date'),
+        Index('ix_courier_shifts_regions', 'regions', postgresql_using='gin'),
+    )
+
+
+# даты, на которые идет инкрементальное распределение, строка блокируется на время вызова
+class assignment_progress(Base):
+    __tablename__ = 'assignment_progress'
+    delivery_date = Column(Date, primary_key=True)
+
+
+# очередь заказов инкрементального распределения на дату: вызов забирает и удаляет свои строки
+# новые заказы попадают в нее триггером на все даты из assignment_progress, отложенные - из assignment_skipped
+class assignment_pending_orders(Base):
+    __tablename__ = 'assignment_pending_orders'
+    delivery_date = Column(Date, primary_key=True)
+    order_id = Column(Integer, ForeignKey(orders.order_id), primary_key=True)
+
+
+# курьеры, добавленные после создания смен даты (тоже триггером): вызов создает им смены
+class assignment_pending_couriers(Base):
+    __tablename__ = 'assignment_pending_couriers'
+    delivery_date = Column(Date, primary_key=True)
+    courier_id = Column(Integer, ForeignKey(couriers.courier_id), primary_key=True)
+
+
+# заказы, которые инкрементальное распределение на дату рассмотрело, но не распределило
+# они возвращаются в очередь, когда в их регионе появляются новые смены или у смены закрывается тур
+class assignment_skipped(Base):
+    __tablename__ = 'assignment_skipped'
+    delivery_date = Column(Date, primary_key=True)
+    order_id = Column(Integer, ForeignKey(orders.order_id), primary_key=True)
+    regions = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index('ix_assignment_skipped_delivery_date_regions', 'delivery_date', 'regions'),
+    )
+
+
+# новые строки orders и couriers ставятся в очереди всех дат инкрементального распределения
+PENDING_QUEUES = (("orders", "assignment_pending_orders", "order_id"),
+                  ("couriers", "assignment_pending_couriers", "courier_id"))
+
+for _table, _queue, _key in PENDING_QUEUES:
+    event.listen(Base.metadata, "after_create", DDL(f"""
+        CREATE OR REPLACE FUNCTION enqueue_{_table}() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO {_queue} (delivery_date, {_key})
+            SELECT assignment_progress.delivery_date, new_rows.{_key} FROM new_rows CROSS JOIN assignment_progress;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+    event.listen(Base.metadata, "after_create", DDL(f"""
+        CREATE OR REPLACE TRIGGER {_table}_enqueue AFTER INSERT ON {_table}
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION enqueue_{_table}()
+    """))
+
+
+# счетчик изменений таблицы (по нему строятся ETag списков): увеличивается при commit транзакции, изменившей
+# строки таблицы, поэтому новая версия становится видна вместе с изменениями
+class table_versions(Base):
+    __tablename__ = 'table_versions'
+    table_name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+
+# таблицы, измененные незавершенными транзакциями: триггер оператора пишет сюда строку (одну на транзакцию
+# и таблицу), а отложенный до commit триггер переносит ее в table_versions и удаляет; строка счетчика
+# блокируется только на время commit, а не от первого изменения до конца транзакции
+class table_version_bumps(Base):
+    __tablename__ = 'table_version_bumps'
+    txid = Column(BigInteger, primary_key=True)
+    table_name = Column(String, primary_key=True)
+
+
+VERSIONED_TABLES = ("couriers", "orders", "orders_assignments")
+
+# операторы, не изменившие ни одной строки (пустая таблица переходов), версию не увеличивают
+event.listen(Base.metadata, "after_create", DDL("""
+    CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'TRUNCATE' THEN
+            IF NOT EXISTS (SELECT 1 FROM changed_rows) THEN
+                RETURN NULL;
+            END IF;
+        END IF;
+        INSERT INTO table_version_bumps (txid, table_name) VALUES (txid_current(), TG_TABLE_NAME)
+        ON CONFLICT DO NOTHING;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""))
+event.listen(Base.metadata, "after_create", DDL("""
+    CREATE OR REPLACE FUNCTION apply_table_version_bump() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO table_versions (table_name, version) VALUES (NEW.table_name, 1)
+        ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1;
+        DELETE FROM table_version_bumps WHERE txid = NEW.txid AND table_name = NEW.table_name;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+"""))
+event.listen(Base.metadata, "after_create", DDL("""
+    CREATE CONSTRAINT TRIGGER table_version_bumps_apply AFTER INSERT ON table_version_bumps
+    DEFERRABLE INITIALLY DEFERRED FOR EACH ROW EXECUTE FUNCTION apply_table_version_bump()
+"""))
+# таблица переходов задается отдельно для каждого события, у TRUNCATE ее нет
+VERSION_TRIGGERS = (("insert", "INSERT", "REFERENCING NEW TABLE AS changed_rows"),
+                    ("update", "UPDATE", "REFERENCING NEW TABLE AS changed_rows"),
+                    ("delete", "DELETE", "REFERENCING OLD TABLE AS changed_rows"),
+                    ("truncate", "TRUNCATE", ""))
+for _table in VERSIONED_TABLES:
+    for _name, _event, _referencing in VERSION_TRIGGERS:
+        event.listen(Base.metadata, "after_create", DDL(f"""
+            CREATE OR REPLACE TRIGGER {_table}_version_{_name} AFTER {_event} ON {_table}
+            {_referencing} FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version()
+        """))
+
+
 ###################################
 # BLOCK WITH DOMAIN-DRIVEN DESIGN #
 ###################################
@@ -80,8 +250,25 @@ class CourierCoefficients:
             self.rating_coeff = 0
 
 
+# время в алгоритме распределения храним в минутах от начала суток, строки вида HH:MM-HH:MM разбираем один раз
+@lru_cache(maxsize=65536)
+def parse_hours(hours: str) -> Tuple[int, int]:
+    start, end = hours.split("-")
+    start_hour, start_minute = start.split(":")
+    end_hour, end_minute = end.split(":")
+    return int(start_hour) * 60 + int(start_minute), int(end_hour) * 60 + int(end_minute)
+
+
+# обратно в time переводим только при формировании ответа
+def minutes_to_time(minutes: int) -> time:
+    minutes %= MINUTES_PER_DAY
+    return time(minutes // 60, minutes % 60)
+
+
 # класс заказа для алгоритма распределения заказов
 class OrderAssign:
+    __slots__ = ("order_id", "regions", "cost", "weight", "delivery_start", "delivery_end")
+
     def __init__(self, order: orders):
         self.order_id = order.order_id
         self.regions = order.regions
@@ -89,20 +276,24 @@ class OrderAssign:
         self.weight = order.weight
 
         # в бд у нас список, но мы упростим модель и будем считать, что у нас одно окно доставки
-        delivery_hours = order.delivery_hours[0]
-        self.delivery_start = datetime.strptime(delivery_hours[:5], '%H:%M').time()
-        self.delivery_end = datetime.strptime(delivery_hours[6:], '%H:%M').time()
+        self.delivery_start, self.delivery_end = parse_hours(order.delivery_hours[0])
 
 
-@dataclass
+@dataclass(slots=True)
 class CourierTurn:
-    turn_time: time = field(default_factory=time)
+    turn_time: int = 0
     regions: List[int] = field(default_factory=list)
     orders: List[int] = field(default_factory=list)
+    assignments_id: Optional[int] = None  # строка orders_assignments, если тур уже сохранен
 
 
 # класс курьера для алгоритма распределения заказов
 class CourierLoad:
+    __slots__ = ("delivery_date", "courier_id", "courier_type", "regions", "working_hours",
+                 "max_load", "max_regions", "max_orders", "time_for_first", "time_for_subs",
+                 "available_load", "available_regions", "available_orders", "start_time", "end_time",
+                 "order_groups_list", "current_turn", "last_deliver_time")
+
     # инициализируем смену
     def __init__(self, courier: couriers, working_hours, delivery_date):
 
@@ -137,10 +328,41 @@ class CourierLoad:
         self.available_load = self.max_load
         self.available_regions = self.max_regions
         self.available_orders = self.max_orders
-        self.start_time = datetime.strptime(working_hours[:5], '%H:%M').time()
-        self.end_time = datetime.strptime(working_hours[6:], '%H:%M').time()
+        self.start_time, self.end_time = parse_hours(working_hours)
         self.order_groups_list = []  # список заказов в текущей смене, по сути это список order_group
         self.current_turn = CourierTurn()  # список заказов в текущей доставке
+        # позже этого времени смена не доставит ни одного заказа: после каждой доставки загруженная смена выбывает
+        self.last_deliver_time = max(self.end_time, self.deliver_time)
+
+    # копия еще не загруженной смены на другую дату, без повторного разбора типа курьера и графика
+    def clone(self, delivery_date) -> "CourierLoad":
+        shift = CourierLoad.__new__(CourierLoad)
+        shift.delivery_date = delivery_date
+        shift.courier_id = self.courier_id
+        shift.courier_type = self.courier_type
+        shift.regions = self.regions
+        shift.working_hours = self.working_hours
+        shift.max_load = shift.available_load = self.max_load
+        shift.max_regions = shift.available_regions = self.max_regions
+        shift.max_orders = shift.available_orders = self.max_orders
+        shift.time_for_first = self.time_for_first
+        shift.time_for_subs = self.time_for_subs
+        shift.start_time = self.start_time
+        shift.end_time = self.end_time
+        shift.order_groups_list = []
+        shift.current_turn = CourierTurn()
+        shift.last_deliver_time = self.last_deliver_time
+        return shift
+
+    # продолжаем смену с сохраненного состояния
+    def restore(self, state: courier_shifts, turn: Optional[orders_assignments] = None):
+        self.start_time = state.start_time
+        self.available_load = state.available_load
+        self.available_regions = state.available_regions
+        self.available_orders = state.available_orders
+        if turn is not None:
+            self.current_turn = CourierTurn(turn_time=state.start_time, regions=list(turn.regions),
+                                            orders=list(turn.orders), assignments_id=turn.assignments_id)
 
     def __gt__(self, other):
         if self.start_time is None:
@@ -158,14 +380,13 @@ class CourierLoad:
 
     @property
     def deliver_time(self):
-        return (datetime.combine(date.today(), self.start_time) + timedelta(minutes=self.time_to_deliver)).time()
+        return self.start_time + self.time_to_deliver
 
     # блок проверок может ли курьер взять заказ
     def __can_allocate_by_time(self, order: OrderAssign) -> bool:
         result = order.delivery_start <= self.deliver_time <= order.delivery_end
         # возможно больше нет заказов в это время, тогда нужно завершить тур и начать заново
-        if not result and (datetime.combine(date.today(), self.end_time) -
-                           timedelta(minutes=self.time_for_first)).time() >= order.delivery_start:
+        if not result and self.end_time - self.time_for_first >= order.delivery_start:
             self.restart_turn()
             self.start_time = order.delivery_start
             result = True
@@ -179,10 +400,21 @@ class CourierLoad:
                 order.regions in self.current_turn.regions or self.available_regions > 0)
         return result
 
+    # статическая проверка: регион, грузоподъемность и конец смены, состояние смены не меняется
+    # смена, не прошедшая ее, заказ не возьмет, но can_allocate все равно может перезапустить ее тур
+    def can_serve(self, order: OrderAssign) -> bool:
+        return order.regions in self.regions and order.weight <= self.max_load and \
+            order.delivery_start <= self.last_deliver_time
+
     def can_allocate(self, order: OrderAssign) -> bool:
         return self.__can_allocate_by_time(order) and \
             self.__can_allocate_by_weight(order) and self.__can_allocate_by_regions(order)
 
+    # смена просмотрена раньше выбранной и заказ не взяла: как и в can_allocate, проверка времени
+    # может завершить тур и перенести начало смены на начало окна заказа
+    def pass_over(self, order: OrderAssign):
+        self.__can_allocate_by_time(order)
+
     # добавим заказ в группу и уменьшим доступные ресурсы курьера
     def allocate(self, order: OrderAssign):
         self.start_time = self.deliver_time
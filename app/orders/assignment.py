@@ -0,0 +1,499 @@
+import asyncio
+import heapq
+from bisect import bisect_left
+from datetime import date
+from sys import maxsize
+from typing import Dict, List, Optional, Tuple
+
+from app.config import ASSIGN_WORKERS
+from app.models import CourierLoad, OrderAssign, minutes_to_time
+from app.orders import feasibility, improvement
+from app.orders.executor import get_process_pool, run_planning
+from app.orders.roster import Roster
+
+# ключ выбывшей смены, больше любого реального (start_time, порядковый номер)
+EMPTY = (maxsize, maxsize)
+
+
+# смены одного региона и одной грузоподъемности
+# дерево отрезков по сменам, отсортированным по last_deliver_time, хранит минимум (start_time, порядковый номер)
+class ShiftBucket:
+    def __init__(self, seqs: List[int], shifts: List[CourierLoad], keys: List[Tuple]):
+        seqs = sorted(seqs, key=lambda seq: shifts[seq].last_deliver_time)
+        self.bounds = [shifts[seq].last_deliver_time for seq in seqs]
+        self.positions = {seq: i for i, seq in enumerate(seqs)}
+        self.size = 1
+        while self.size < len(seqs):
+            self.size *= 2
+        self.tree = [EMPTY] * (2 * self.size)
+        for i, seq in enumerate(seqs):
+            self.tree[self.size + i] = keys[seq]
+        for i in range(self.size - 1, 0, -1):
+            self.tree[i] = min(self.tree[2 * i], self.tree[2 * i + 1])
+
+    def update(self, seq: int, key: Tuple):
+        i = self.size + self.positions[seq]
+        self.tree[i] = key
+        i //= 2
+        while i:
+            left, right = self.tree[2 * i], self.tree[2 * i + 1]
+            value = left if left < right else right
+            if self.tree[i] == value:
+                break
+            self.tree[i] = value
+            i //= 2
+
+    # самая ранняя смена среди тех, что успевают к началу окна доставки
+    def first(self, delivery_start: int) -> Tuple:
+        lo = self.size + bisect_left(self.bounds, delivery_start)
+        hi = 2 * self.size
+        result = EMPTY
+        while lo < hi:
+            if lo & 1:
+                result = min(result, self.tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                result = min(result, self.tree[hi])
+            lo //= 2
+            hi //= 2
+        return result
+
+
+# смены с открытым туром, отсортированные по последнему времени, с которого еще можно начать тур (end_time - time_for_first)
+# дерево отрезков хранит минимум ключа (start_time, порядковый номер) и минимум/максимум deliver_time,
+# по ним находятся смены, у которых проверка времени перезапустит тур, без перебора остальных
+class ShiftTimeline:
+    def __init__(self, shifts: List[CourierLoad], idle: List[bool]):
+        seqs = sorted(range(len(shifts)), key=lambda seq: shifts[seq].end_time - shifts[seq].time_for_first)
+        self.bounds = [shifts[seq].end_time - shifts[seq].time_for_first for seq in seqs]
+        self.positions = {seq: i for i, seq in enumerate(seqs)}
+        self.size = 1
+        while self.size < len(seqs):
+            self.size *= 2
+        self.keys = [EMPTY] * (2 * self.size)
+        self.low = [maxsize] * (2 * self.size)
+        self.high = [-maxsize] * (2 * self.size)
+        for i, seq in enumerate(seqs):
+            if not idle[seq]:
+                shift = shifts[seq]
+                self.keys[self.size + i] = (shift.start_time, seq)
+                self.low[self.size + i] = self.high[self.size + i] = shift.deliver_time
+        for i in range(self.size - 1, 0, -1):
+            self._pull(i)
+
+    def _pull(self, i: int):
+        self.keys[i] = min(self.keys[2 * i], self.keys[2 * i + 1])
+        self.low[i] = min(self.low[2 * i], self.low[2 * i + 1])
+        self.high[i] = max(self.high[2 * i], self.high[2 * i + 1])
+
+    def update(self, seq: int, shift: Optional[CourierLoad]):
+        i = self.size + self.positions[seq]
+        if shift is None:
+            self.keys[i], self.low[i], self.high[i] = EMPTY, maxsize, -maxsize
+        else:
+            self.keys[i] = (shift.start_time, seq)
+            self.low[i] = self.high[i] = shift.deliver_time
+        i //= 2
+        while i:
+            self._pull(i)
+            i //= 2
+
+    # проверка времени у смен раньше before (в порядке обхода), кроме выбранной: тур перезапускается у тех, что еще
+    # могут начать его к началу окна заказа, но не доставят в окно со своим deliver_time, остальные не просматриваются
+    # после перезапуска тур пуст, и смена уходит из дерева в IdleCohort; узлы пересчитываются один раз после прохода
+    def restart(self, shifts: List[CourierLoad], order: OrderAssign, before: Tuple, chosen: Optional[int]) -> List[int]:
+        start, end = order.delivery_start, order.delivery_end
+        keys, low, high, size = self.keys, self.low, self.high, self.size
+        first = bisect_left(self.bounds, start)
+        result = []
+        visited = []
+        stack = [(1, 0, size)]
+        while stack:
+            i, lo, hi = stack.pop()
+            if hi <= first or keys[i] >= before or (low[i] >= start and high[i] <= end):
+                continue
+            if i >= size:
+                seq = keys[i][1]
+                if seq != chosen:
+                    shifts[seq].pass_over(order)
+                    keys[i], low[i], high[i] = EMPTY, maxsize, -maxsize
+                    result.append(seq)
+                continue
+            visited.append(i)
+            middle = (lo + hi) // 2
+            stack.append((2 * i + 1, middle, hi))
+            stack.append((2 * i, lo, middle))
+        # потомки попали в visited после родителей
+        for i in reversed(visited):
+            self._pull(i)
+        return result
+
+
+# смены без открытого тура с одной грузоподъемностью, временем на заказ и концом смены и с одним началом
+# проверка времени дает у них один и тот же результат, поэтому перезапуск и поиск первой подходящей смены
+# идут по группе целиком; start_time самой смены обновляется, только когда она выходит из группы
+class IdleCohort:
+    def __init__(self, start_time: int):
+        self.start_time = start_time
+        self.members = set()
+        self.regions: Dict[int, List[int]] = {}  # куча порядковых номеров на регион, ушедшие смены удаляются лениво
+
+
+# IdleCohort смен с одинаковыми параметрами, кроме начала
+class IdleGroup:
+    def __init__(self, shift: CourierLoad):
+        self.max_load = shift.max_load
+        self.time_for_first = shift.time_for_first
+        self.latest_start = shift.end_time - shift.time_for_first
+        self.regions = set()
+        self.cohorts: Dict[int, IdleCohort] = {}
+
+
+# индекс смен курьеров для алгоритма распределения заказов
+# порядок обхода тот же, что у sorted(available_couriers): по времени начала, при равенстве - по порядку добавления
+# заказ получает первая смена, прошедшая can_allocate: смены с открытым туром ищем в ShiftBucket региона заказа
+# с подходящей грузоподъемностью, пустые - по IdleCohort; проверку времени у смен раньше выбранной, которые заказ
+# не возьмут, повторяем через ShiftTimeline и IdleCohort - туры перезапускаются так же, как при полном переборе
+# restart_others=False отключает это для инкрементального режима: в нем подняты не все смены дня
+class CourierPool:
+    def __init__(self, shifts: List[CourierLoad], restart_others: bool = True):
+        self.shifts = shifts
+        self.loaded = []  # смены, которые больше не могут брать заказы, в порядке загрузки
+        self._alive = [True] * len(shifts)
+        self._max_loads = sorted({shift.max_load for shift in shifts})
+        self._regions = [list(set(shift.regions)) for shift in shifts]
+
+        groups: Dict[Tuple[int, int, int], IdleGroup] = {}
+        self._group_of: List[IdleGroup] = []
+        for shift in shifts:
+            key = (shift.max_load, shift.time_for_first, shift.end_time)
+            if key not in groups:
+                groups[key] = IdleGroup(shift)
+            groups[key].regions.update(shift.regions)
+            self._group_of.append(groups[key])
+        self._groups = list(groups.values())
+        self._cohort_of: List[Optional[IdleCohort]] = [None] * len(shifts)
+
+        idle = [self._is_idle(shift) for shift in shifts]
+        keys = [EMPTY if idle[seq] else (shift.start_time, seq) for seq, shift in enumerate(shifts)]
+        self._timeline = ShiftTimeline(shifts, idle) if restart_others else None
+
+        members: Dict[Tuple[int, int], List[int]] = {}
+        for seq, shift in enumerate(shifts):
+            for region in self._regions[seq]:
+                members.setdefault((region, shift.max_load), []).append(seq)
+        self._buckets = {key: ShiftBucket(seqs, shifts, keys) for key, seqs in members.items()}
+        self._shift_buckets: List[List[ShiftBucket]] = [[] for _ in shifts]
+        for key, seqs in members.items():
+            for seq in seqs:
+                self._shift_buckets[seq].append(self._buckets[key])
+
+        for seq in range(len(shifts)):
+            if idle[seq]:
+                self._add_idle(seq)
+
+    @staticmethod
+    def _is_idle(shift: CourierLoad) -> bool:
+        return not shift.current_turn.orders and shift.available_load == shift.max_load and \
+            shift.available_regions == shift.max_regions and shift.available_orders == shift.max_orders
+
+    def _set_key(self, seq: int, key: Tuple):
+        for bucket in self._shift_buckets[seq]:
+            bucket.update(seq, key)
+
+    def _join(self, cohort: IdleCohort, seq: int):
+        cohort.members.add(seq)
+        self._cohort_of[seq] = cohort
+        for region in self._regions[seq]:
+            heapq.heappush(cohort.regions.setdefault(region, []), seq)
+
+    def _add_idle(self, seq: int):
+        cohorts = self._group_of[seq].cohorts
+        start_time = self.shifts[seq].start_time
+        if start_time not in cohorts:
+            cohorts[start_time] = IdleCohort(start_time)
+        self._join(cohorts[start_time], seq)
+
+    def _leave_idle(self, seq: int):
+        cohort = self._cohort_of[seq]
+        cohort.members.discard(seq)
+        self._cohort_of[seq] = None
+        self.shifts[seq].start_time = cohort.start_time
+        if not cohort.members:
+            del self._group_of[seq].cohorts[cohort.start_time]
+
+    # смена после изменения состояния: выбыла, осталась с открытым туром или вернулась в IdleCohort
+    def _place(self, seq: int):
+        shift = self.shifts[seq]
+        if self._alive[seq] and not self._is_idle(shift):
+            self._set_key(seq, (shift.start_time, seq))
+            if self._timeline is not None:
+                self._timeline.update(seq, shift)
+            return
+        self._set_key(seq, EMPTY)
+        if self._timeline is not None:
+            self._timeline.update(seq, None)
+        if self._alive[seq]:
+            self._add_idle(seq)
+
+    # перенос начала смен группы (или ее смен с порядковым номером меньше below) на start_time,
+    # меньшая из сливаемых групп переходит в большую
+    def _move(self, group: IdleGroup, cohort: IdleCohort, start_time: int, below: Optional[int] = None):
+        cohorts = group.cohorts
+        target = cohorts.get(start_time)
+        if below is None:
+            del cohorts[cohort.start_time]
+            if target is None:
+                cohort.start_time = start_time
+                cohorts[start_time] = cohort
+                return
+            if len(cohort.members) > len(target.members):
+                cohort, target = target, cohort
+                target.start_time = start_time
+                cohorts[start_time] = target
+            moving = cohort.members
+        else:
+            moving = [seq for seq in cohort.members if seq < below]
+            if not moving:
+                return
+            if 2 * len(moving) > len(cohort.members):
+                # остающихся меньше: отделяем их, а группу переносим целиком
+                rest = IdleCohort(cohort.start_time)
+                for seq in cohort.members.difference(moving):
+                    cohort.members.discard(seq)
+                    self._join(rest, seq)
+                self._move(group, cohort, start_time)
+                if rest.members:
+                    cohorts[rest.start_time] = rest
+                return
+            cohort.members.difference_update(moving)
+            if not cohort.members:
+                del cohorts[cohort.start_time]
+            if target is None:
+                target = cohorts[start_time] = IdleCohort(start_time)
+        for seq in moving:
+            self._join(target, seq)
+
+    # первая в порядке обхода пустая смена, которая может взять заказ
+    def _first_idle(self, order: OrderAssign) -> Tuple:
+        start, end = order.delivery_start, order.delivery_end
+        cohort_of = self._cohort_of
+        result = EMPTY
+        for group in self._groups:
+            if group.max_load < order.weight or order.regions not in group.regions:
+                continue
+            restarts = group.latest_start >= start
+            for start_time, cohort in group.cohorts.items():
+                if start_time > result[0]:
+                    continue
+                if not restarts and not start <= start_time + group.time_for_first <= end:
+                    continue
+                heap = cohort.regions.get(order.regions)
+                while heap and cohort_of[heap[0]] is not cohort:
+                    heapq.heappop(heap)
+                if heap and (start_time, heap[0]) < result:
+                    result = (start_time, heap[0])
+        return result
+
+    # проверка времени у пустых смен раньше before: перезапуск пустого тура только переносит начало на начало окна
+    def _restart_idle(self, order: OrderAssign, before: Tuple):
+        start, end = order.delivery_start, order.delivery_end
+        for group in self._groups:
+            if group.latest_start < start:
+                continue
+            moving = [cohort for start_time, cohort in group.cohorts.items()
+                      if start_time != start and start_time <= before[0] and
+                      not start <= start_time + group.time_for_first <= end]
+            for cohort in moving:
+                self._move(group, cohort, start, before[1] if cohort.start_time == before[0] else None)
+
+    def _candidates(self, order: OrderAssign) -> List[ShiftBucket]:
+        return [self._buckets[(order.regions, max_load)] for max_load in self._max_loads
+                if max_load >= order.weight and (order.regions, max_load) in self._buckets]
+
+    # первая по времени смена, которая может взять заказ, получает его
+    def assign(self, order: OrderAssign) -> Optional[CourierLoad]:
+        buckets = self._candidates(order)
+        idle_key = self._first_idle(order)
+        probed = []
+        chosen, chosen_key = None, EMPTY
+        while chosen is None:
+            best, best_bucket = idle_key, None
+            for bucket in buckets:
+                key = bucket.first(order.delivery_start)
+                if key < best:
+                    best, best_bucket = key, bucket
+            if best_bucket is None:
+                if idle_key != EMPTY:
+                    chosen, chosen_key = idle_key[1], idle_key
+                break
+            seq = best[1]
+            if self.shifts[seq].can_allocate(order):
+                chosen, chosen_key = seq, best
+            else:
+                # до конца прохода смена не участвует, как при обходе заранее отсортированного списка
+                best_bucket.update(seq, EMPTY)
+                probed.append(seq)
+
+        for seq in probed:
+            self._set_key(seq, (self.shifts[seq].start_time, seq))
+        idle = chosen is not None and self._cohort_of[chosen] is not None
+        if idle:
+            self._leave_idle(chosen)
+
+        # смены других регионов и меньшей грузоподъемности, которые полный перебор просмотрел бы до выбранной
+        if self._timeline is not None:
+            self._restart_idle(order, chosen_key)
+            for seq in self._timeline.restart(self.shifts, order, chosen_key, chosen):
+                self._set_key(seq, EMPTY)
+                self._add_idle(seq)
+
+        if chosen is None:
+            return None
+        courier = self.shifts[chosen]
+        # пустая смена идет первой в порядке обхода, проверка пройдет и может перенести начало смены
+        if idle:
+            courier.can_allocate(order)
+        courier.allocate(order)
+        if courier.is_loaded():
+            self._alive[chosen] = False
+            self.loaded.append(courier)
+        self._place(chosen)
+        return courier
+
+    # загруженные смены в порядке загрузки, затем оставшиеся в исходном порядке
+    def drain(self) -> List[CourierLoad]:
+        for seq, cohort in enumerate(self._cohort_of):
+            if cohort is not None:
+                self.shifts[seq].start_time = cohort.start_time
+        return self.loaded + [shift for seq, shift in enumerate(self.shifts) if self._alive[seq]]
+
+
+# смена на каждый интервал рабочего времени курьера
+def build_shifts(courier_rows, delivery_date: date) -> List[CourierLoad]:
+    if isinstance(courier_rows, Roster):
+        return courier_rows.shifts(delivery_date)
+    return [CourierLoad(_courier, working_hours, delivery_date)
+            for _courier in courier_rows for working_hours in _courier.working_hours]
+
+
+def assign_orders(shifts: List[CourierLoad], orders_list: List[OrderAssign],
+                  prefilter: bool = False) -> List[CourierLoad]:
+    if prefilter:
+        shifts, orders_list = feasibility.prefilter(shifts, orders_list)
+    pool = CourierPool(shifts)
+    for order in orders_list:
+        pool.assign(order)
+    return pool.drain()
+
+
+# закрываем текущие туры и собираем строки для orders_assignments
+def build_assignments(shifts: List[CourierLoad]) -> List[dict]:
+    result = []
+    for turn in shifts:
+        turn.restart_turn()
+        for group in turn.order_groups_list:
+            result.append(dict(courier_id=turn.courier_id, courier_type=turn.courier_type,
+                               delivery_date=turn.delivery_date, turn_time=minutes_to_time(group.turn_time),
+                               regions=group.regions, orders=group.orders))
+    return result
+
+
+# весь расчет плана по строкам курьеров и заказов из бд, чтобы его можно было выполнить в другом потоке или процессе
+# budget_ms > 0 включает улучшение жадного плана локальным поиском на указанное время
+def plan_assignments(courier_rows, order_rows, delivery_date: date, prefilter: bool = False,
+                     budget_ms: int = 0) -> List[dict]:
+    orders_list = [OrderAssign(_order) for _order in order_rows]
+    return assign_partition(build_shifts(courier_rows, delivery_date), orders_list, prefilter, budget_ms)
+
+
+# план на несколько дней за один проход: смены строятся на каждый день заново,
+# а заказы, не попавшие ни в один тур, переходят на следующий день
+def plan_range(courier_rows, order_rows, delivery_dates: List[date], prefilter: bool = False) -> List[dict]:
+    orders_list = [OrderAssign(_order) for _order in order_rows]
+    result = []
+    for delivery_date in delivery_dates:
+        if not orders_list:
+            break
+        rows = build_assignments(assign_orders(build_shifts(courier_rows, delivery_date), orders_list,
+                                               prefilter=prefilter))
+        assigned = {order_id for row in rows for order_id in row["orders"]}
+        orders_list = [order for order in orders_list if order.order_id not in assigned]
+        result.extend(rows)
+    return result
+
+
+# курьер берет заказы только своих регионов, поэтому связные компоненты графа регионов
+# (регионы связаны, если их обслуживает одна смена) распределяются независимо друг от друга
+# компоненты раскладываются на parts частей примерно равного размера, порядок смен и заказов внутри части сохраняется
+# план может отличаться от последовательного: заказ перезапускает туры и у смен других компонент
+def partition(shifts: List[CourierLoad], orders_list: List[OrderAssign],
+              parts: int) -> List[Tuple[List[CourierLoad], List[OrderAssign]]]:
+    parent: Dict[int, int] = {}
+
+    def find(region: int) -> int:
+        root = region
+        while parent[root] != root:
+            root = parent[root]
+        while parent[region] != root:
+            parent[region], region = root, parent[region]
+        return root
+
+    for shift in shifts:
+        for region in shift.regions:
+            parent.setdefault(region, region)
+            parent[find(region)] = find(shift.regions[0])
+
+    sizes: Dict[int, int] = {}
+    for shift in shifts:
+        if shift.regions:
+            root = find(shift.regions[0])
+            sizes[root] = sizes.get(root, 0) + 1
+    for order in orders_list:
+        if order.regions in parent:
+            root = find(order.regions)
+            sizes[root] += 1
+
+    # крупные компоненты раскладываем первыми в наименее загруженную часть
+    bins = [(0, i) for i in range(max(1, min(parts, len(sizes))))]
+    part_of: Dict[int, int] = {}
+    for root in sorted(sizes, key=sizes.get, reverse=True):
+        size, i = heapq.heappop(bins)
+        part_of[root] = i
+        heapq.heappush(bins, (size + sizes[root], i))
+
+    result = [([], []) for _ in bins]
+    for shift in shifts:
+        if shift.regions:
+            result[part_of[find(shift.regions[0])]][0].append(shift)
+    for order in orders_list:
+        if order.regions in parent:
+            result[part_of[find(order.regions)]][1].append(order)
+    return [part for part in result if part[1]]
+
+
+# выполняется в отдельном процессе, поэтому возвращаем готовые строки, а не смены
+def assign_partition(shifts: List[CourierLoad], orders_list: List[OrderAssign], prefilter: bool = False,
+                     budget_ms: int = 0) -> List[dict]:
+    shifts = assign_orders(shifts, orders_list, prefilter=prefilter)
+    if budget_ms > 0:
+        return improvement.improve(shifts, orders_list, budget_ms)
+    return build_assignments(shifts)
+
+
+def plan_partitions(courier_rows, order_rows, delivery_date: date,
+                    parts: int) -> List[Tuple[List[CourierLoad], List[OrderAssign]]]:
+    return partition(build_shifts(courier_rows, delivery_date), [OrderAssign(_order) for _order in order_rows], parts)
+
+
+async def assign_parallel(courier_rows, order_rows, delivery_date: date, prefilter: bool = False,
+                          budget_ms: int = 0) -> List[dict]:
+    loop = asyncio.get_running_loop()
+    parts = await run_planning(plan_partitions, courier_rows, order_rows, delivery_date, ASSIGN_WORKERS)
+    executor = get_process_pool()
+    results = await asyncio.gather(*(
+        loop.run_in_executor(executor, assign_partition, part_shifts, part_orders, prefilter, budget_ms)
+        for part_shifts, part_orders in parts
+    ))
+    return [row for rows in results for row in rows]
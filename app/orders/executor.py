@@ -0,0 +1,52 @@
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from app.config import ASSIGN_EXECUTOR, ASSIGN_WORKERS
+
+# можно переключить во время работы, например из бенчмарка
+PLANNING_EXECUTOR = ASSIGN_EXECUTOR
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_thread_pool: Optional[ThreadPoolExecutor] = None
+
+
+# пул процессов создаем при первом параллельном распределении и переиспользуем
+def get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=ASSIGN_WORKERS)
+    return _process_pool
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=ASSIGN_WORKERS, thread_name_prefix="assign")
+    return _thread_pool
+
+
+def get_planning_executor() -> Optional[Executor]:
+    if PLANNING_EXECUTOR == "process":
+        return get_process_pool()
+    if PLANNING_EXECUTOR == "thread":
+        return get_thread_pool()
+    return None
+
+
+# расчет плана занимает процессор, поэтому выносим его из цикла событий, чтобы не стояли остальные запросы
+async def run_planning(func: Callable, *args):
+    executor = get_planning_executor()
+    if executor is None:
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+def shutdown():
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(cancel_futures=True)
+        _thread_pool = None
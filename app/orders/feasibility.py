@@ -0,0 +1,72 @@
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterator, List, Tuple
+
+from app.models import CourierLoad, OrderAssign
+
+if TYPE_CHECKING:
+    import numpy
+
+CHUNK_SIZE = 1024
+
+
+# numpy в базовые зависимости не входит (requirements-prefilter.txt) и импортируется при первом вызове фильтра
+# None, если он не установлен
+@lru_cache(maxsize=None)
+def load_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+# матрица заказы x смены, в которой отмечены пары, прошедшие CourierLoad.can_serve
+# считается блоками по CHUNK_SIZE заказов, чтобы не держать в памяти всю матрицу
+def feasibility_mask(shifts: List[CourierLoad], orders_list: List[OrderAssign],
+                     chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[int, "numpy.ndarray"]]:
+    np = load_numpy()
+    if np is None:
+        raise RuntimeError("Для матрицы допустимости нужен numpy: pip install -r requirements-prefilter.txt")
+    regions = {}
+    rows, columns = [], []
+    for seq, shift in enumerate(shifts):
+        for region in set(shift.regions):
+            rows.append(regions.setdefault(region, len(regions)))
+            columns.append(seq)
+    # последняя строка - для регионов, в которых нет ни одного курьера
+    membership = np.zeros((len(regions) + 1, len(shifts)), dtype=bool)
+    membership[rows, columns] = True
+
+    max_load = np.fromiter((shift.max_load for shift in shifts), dtype=np.float64, count=len(shifts))
+    last_deliver_time = np.fromiter((shift.last_deliver_time for shift in shifts), dtype=np.int32, count=len(shifts))
+    order_regions = np.fromiter((regions.get(order.regions, len(regions)) for order in orders_list),
+                                dtype=np.intp, count=len(orders_list))
+    weight = np.fromiter((order.weight for order in orders_list), dtype=np.float64, count=len(orders_list))
+    delivery_start = np.fromiter((order.delivery_start for order in orders_list), dtype=np.int32,
+                                 count=len(orders_list))
+
+    for lo in range(0, len(orders_list), chunk_size):
+        hi = lo + chunk_size
+        block = membership[order_regions[lo:hi]]
+        block &= weight[lo:hi, None] <= max_load
+        block &= delivery_start[lo:hi, None] <= last_deliver_time
+        yield lo, block
+
+
+# отбрасываем смены, которым не подходит ни один заказ: жадный алгоритм их никогда не выберет,
+# а их перезапуски туров на другие смены не влияют, поэтому результат распределения не меняется
+# заказы остаются все: даже заказ, который не возьмет ни одна смена, перезапускает туры смен при проверке времени
+# без numpy смены не отбрасываются, распределение идет обычным путем с тем же результатом
+def prefilter(shifts: List[CourierLoad],
+              orders_list: List[OrderAssign]) -> Tuple[List[CourierLoad], List[OrderAssign]]:
+    np = load_numpy()
+    if np is None or not shifts or not orders_list:
+        return shifts, orders_list
+    # для маски важны только регион, вес и начало окна, поэтому одинаковые заказы считаем один раз
+    representatives = list({(order.regions, order.weight, order.delivery_start): order
+                            for order in orders_list}.values())
+
+    used_shifts = np.zeros(len(shifts), dtype=bool)
+    for lo, block in feasibility_mask(shifts, representatives):
+        used_shifts |= block.any(axis=0)
+    return [shifts[i] for i in np.flatnonzero(used_shifts)], orders_list
@@ -0,0 +1,177 @@
+import time
+from typing import Dict, List, Optional
+
+from app.models import CourierLoad, OrderAssign, minutes_to_time, parse_hours
+
+
+# тур в плане: время выхода курьера и заказы в порядке доставки
+# i-й заказ доставляется в start + time_for_first + i * time_for_subs
+class PlanTurn:
+    __slots__ = ("start", "orders")
+
+    def __init__(self, start: int, orders_list: List[OrderAssign]):
+        self.start = start
+        self.orders = orders_list
+
+
+class ShiftPlan:
+    __slots__ = ("shift", "work_start", "turns")
+
+    def __init__(self, shift: CourierLoad, turns: List[PlanTurn]):
+        self.shift = shift
+        self.work_start = parse_hours(shift.working_hours)[0]
+        self.turns = turns
+
+    def last_delivery(self, start: int, count: int) -> int:
+        return start + self.shift.time_for_first + (count - 1) * self.shift.time_for_subs
+
+    # ограничения курьера на один тур и окна доставки заказов
+    def is_valid(self, start: int, orders_list: List[OrderAssign]) -> bool:
+        shift = self.shift
+        if len(orders_list) > shift.max_orders or sum(order.weight for order in orders_list) > shift.max_load:
+            return False
+        regions = {order.regions for order in orders_list}
+        if len(regions) > shift.max_regions or not regions.issubset(shift.regions):
+            return False
+        deliver_time = start + shift.time_for_first
+        for order in orders_list:
+            if not order.delivery_start <= deliver_time <= order.delivery_end:
+                return False
+            deliver_time += shift.time_for_subs
+        return deliver_time - shift.time_for_subs <= shift.end_time
+
+    # тур не пересекается по времени с остальными турами смены
+    def is_free(self, start: int, end: int, skip: Optional[PlanTurn] = None) -> bool:
+        return all(turn is skip or end <= turn.start or self.last_delivery(turn.start, len(turn.orders)) <= start
+                   for turn in self.turns)
+
+    def fits(self, turn: Optional[PlanTurn], start: int, orders_list: List[OrderAssign]) -> bool:
+        return self.is_valid(start, orders_list) and \
+            self.is_free(start, self.last_delivery(start, len(orders_list)), skip=turn)
+
+    # вставка заказа в существующий тур (время выхода не меняется) или отдельным туром в свободное время
+    def insert(self, order: OrderAssign) -> bool:
+        if not self.shift.can_serve(order):
+            return False
+        for turn in self.turns:
+            for position in range(len(turn.orders) + 1):
+                orders_list = turn.orders[:position] + [order] + turn.orders[position:]
+                if self.fits(turn, turn.start, orders_list):
+                    turn.orders = orders_list
+                    return True
+
+        earliest = max(self.work_start, order.delivery_start - self.shift.time_for_first)
+        starts = sorted({earliest} | {self.last_delivery(turn.start, len(turn.orders)) for turn in self.turns})
+        for start in starts:
+            if start >= earliest and self.fits(None, start, [order]):
+                self.turns.append(PlanTurn(start, [order]))
+                return True
+        return False
+
+
+# улучшение жадного плана локальным поиском в пределах бюджета времени
+# каждый принятый ход увеличивает число распределенных заказов или их стоимость, поэтому план после любого хода
+# допустим и лучше предыдущего: при окончании бюджета возвращается лучший найденный
+class Improvement:
+    def __init__(self, shifts: List[CourierLoad], orders_list: List[OrderAssign], deadline: float):
+        self.deadline = deadline
+        by_id = {order.order_id: order for order in orders_list}
+        self.plans: List[ShiftPlan] = []
+        self.by_region: Dict[int, List[ShiftPlan]] = {}
+        assigned = set()
+        for shift in shifts:
+            shift.restart_turn()
+            turns = []
+            for group in shift.order_groups_list:
+                turn_orders = [by_id[order_id] for order_id in group.orders]
+                start = group.turn_time - shift.time_for_first - (len(turn_orders) - 1) * shift.time_for_subs
+                turns.append(PlanTurn(start, turn_orders))
+                assigned.update(group.orders)
+            plan = ShiftPlan(shift, turns)
+            self.plans.append(plan)
+            for region in set(shift.regions):
+                self.by_region.setdefault(region, []).append(plan)
+        # сначала пробуем пристроить самые дорогие заказы
+        self.unassigned = sorted((order for order in orders_list if order.order_id not in assigned),
+                                 key=lambda order: -order.cost)
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def insert(self, order: OrderAssign) -> bool:
+        return any(plan.insert(order) for plan in self.by_region.get(order.regions, []))
+
+    # места, куда можно поставить заказ вместо уже распределенного заказа
+    def replacements(self, order: OrderAssign):
+        for plan in self.by_region.get(order.regions, []):
+            if self.expired():
+                return
+            if not plan.shift.can_serve(order):
+                continue
+            for turn in list(plan.turns):
+                for removed in range(len(turn.orders)):
+                    rest = turn.orders[:removed] + turn.orders[removed + 1:]
+                    for position in range(len(rest) + 1):
+                        orders_list = rest[:position] + [order] + rest[position:]
+                        if plan.fits(turn, turn.start, orders_list):
+                            yield plan, turn, removed, orders_list
+                            break
+
+    # заказ встает на место распределенного, а тот переезжает в другой тур
+    def relocate(self, order: OrderAssign) -> bool:
+        for _plan, turn, removed, orders_list in self.replacements(order):
+            previous = turn.orders
+            moved = previous[removed]
+            turn.orders = orders_list
+            if self.insert(moved):
+                return True
+            turn.orders = previous
+        return False
+
+    # заказ вытесняет более дешевый, который становится нераспределенным
+    def swap(self, order: OrderAssign) -> Optional[OrderAssign]:
+        for _plan, turn, removed, orders_list in self.replacements(order):
+            if turn.orders[removed].cost < order.cost:
+                ejected = turn.orders[removed]
+                turn.orders = orders_list
+                return ejected
+        return None
+
+    def run(self) -> List[ShiftPlan]:
+        improved = True
+        while improved and not self.expired():
+            improved = False
+            for order in list(self.unassigned):
+                if self.expired():
+                    break
+                if self.insert(order) or self.relocate(order):
+                    self.unassigned.remove(order)
+                    improved = True
+                    continue
+                ejected = self.swap(order)
+                if ejected is not None:
+                    self.unassigned.remove(order)
+                    self.unassigned.append(ejected)
+                    improved = True
+        return self.plans
+
+
+def build_plan_assignments(plans: List[ShiftPlan]) -> List[dict]:
+    result = []
+    for plan in plans:
+        shift = plan.shift
+        for turn in plan.turns:
+            regions: List[int] = []
+            for order in turn.orders:
+                if order.regions not in regions:
+                    regions.append(order.regions)
+            result.append(dict(courier_id=shift.courier_id, courier_type=shift.courier_type,
+                               delivery_date=shift.delivery_date,
+                               turn_time=minutes_to_time(plan.last_delivery(turn.start, len(turn.orders))),
+                               regions=regions, orders=[order.order_id for order in turn.orders]))
+    return result
+
+
+def improve(shifts: List[CourierLoad], orders_list: List[OrderAssign], budget_ms: int) -> List[dict]:
+    deadline = time.monotonic() + budget_ms / 1000
+    return build_plan_assignments(Improvement(shifts, orders_list, deadline).run())
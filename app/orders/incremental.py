@@ -0,0 +1,231 @@
+from datetime import date
+from typing import List, Set
+
+from fastapi import HTTPException
+from sqlalchemy import Date, delete, func, insert, literal, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from app.models import couriers, orders, orders_assignments, assignment_orders, courier_shifts, \
+    assignment_progress, assignment_pending_orders, assignment_pending_couriers, assignment_skipped, \
+    CourierLoad, CourierTurn, OrderAssign, minutes_to_time
+from app.orders.assignment import CourierPool
+
+# пространство ключей pg_advisory_xact_lock для блокировки даты распределения
+ASSIGN_DATE_LOCK = 5201
+
+
+def _mixed_modes_error(delivery_date: date, details: str) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail={
+        "status": "error",
+        "data": {"delivery_date": str(delivery_date)},
+        "details": details
+    })
+
+
+# режимы распределения на одну дату не смешиваются: инкрементальное ведет загрузку смен в courier_shifts
+# и не знает о турах полного распределения, а полное не знает о турах инкрементального - курьеры получили бы
+# пересекающиеся туры; блокировка даты до конца транзакции не дает режимам проверить дату одновременно
+async def lock_dates(session: AsyncSession, delivery_dates: List[date]):
+    for delivery_date in sorted(delivery_dates):
+        await session.execute(select(func.pg_advisory_xact_lock(ASSIGN_DATE_LOCK, delivery_date.toordinal())))
+
+
+# проверка перед полным распределением (и на диапазон дат)
+async def reject_incremental_dates(session: AsyncSession, delivery_dates: List[date]):
+    await lock_dates(session, delivery_dates)
+    query = select(assignment_progress.delivery_date). \
+        filter(assignment_progress.delivery_date.in_(delivery_dates)).order_by(assignment_progress.delivery_date)
+    result = await session.execute(query)
+    delivery_date = result.scalars().first()
+    if delivery_date is not None:
+        raise _mixed_modes_error(delivery_date, "На дату идет инкрементальное распределение, "
+                                                "его можно завершить через DELETE /orders/assign/incremental/{дата}")
+
+
+# смены курьеров на дату, возвращает регионы новых смен
+def add_shifts(session: AsyncSession, delivery_date: date, courier_rows) -> Set[int]:
+    regions = set()
+    for _courier in courier_rows:
+        for working_hours in _courier.working_hours:
+            shift = CourierLoad(_courier, working_hours, delivery_date)
+            session.add(courier_shifts(courier_id=shift.courier_id, courier_type=shift.courier_type,
+                                       delivery_date=delivery_date, working_hours=working_hours,
+                                       regions=shift.regions, start_time=shift.start_time,
+                                       available_load=shift.available_load,
+                                       available_regions=shift.available_regions,
+                                       available_orders=shift.available_orders, is_loaded=False))
+            regions.update(shift.regions)
+    return regions
+
+
+# первый вызов на дату: смены всем курьерам и в очередь все еще не распределенные заказы
+# до конца транзакции таблицы закрыты для записи, поэтому строка, вставленная параллельно, попадет либо в этот
+# отбор, либо в очередь через триггер, который после commit уже видит дату в assignment_progress
+async def start_incremental(session: AsyncSession, delivery_date: date):
+    await session.execute(text("LOCK TABLE couriers, orders IN SHARE MODE"))
+    session.add(assignment_progress(delivery_date=delivery_date))
+    result = await session.execute(select(couriers).order_by(couriers.courier_id))
+    add_shifts(session, delivery_date, [r for r, in result])
+    query = select(literal(delivery_date, Date), orders.order_id).filter(
+        orders.completed_time == None,
+        ~select(assignment_orders.order_id).filter(assignment_orders.order_id == orders.order_id).exists()
+    )
+    await session.execute(insert(assignment_pending_orders).from_select(["delivery_date", "order_id"], query))
+    await session.flush()
+
+
+# смены курьерам, добавленным после первого вызова на дату
+async def add_pending_couriers(session: AsyncSession, delivery_date: date) -> Set[int]:
+    query = delete(assignment_pending_couriers).filter(assignment_pending_couriers.delivery_date == delivery_date). \
+        returning(assignment_pending_couriers.courier_id)
+    courier_ids = (await session.execute(query)).scalars().all()
+    if not courier_ids:
+        return set()
+    result = await session.execute(select(couriers).filter(couriers.courier_id.in_(courier_ids)).
+                                   order_by(couriers.courier_id))
+    regions = add_shifts(session, delivery_date, [r for r, in result])
+    await session.flush()
+    return regions
+
+
+# отложенные заказы регионов, в которых появились свободные смены, возвращаются в очередь даты
+async def retry_skipped(session: AsyncSession, delivery_date: date, regions: Set[int]):
+    if not regions:
+        return
+    moved = delete(assignment_skipped).filter(assignment_skipped.delivery_date == delivery_date,
+                                              assignment_skipped.regions.in_(sorted(regions))). \
+        returning(assignment_skipped.delivery_date, assignment_skipped.order_id).cte("moved")
+    await session.execute(insert(assignment_pending_orders).from_select(["delivery_date", "order_id"], select(moved)))
+
+
+# завершение инкрементального распределения на дату: туры остаются, состояние смен и очереди удаляются,
+# после этого на дату снова можно запускать полное распределение
+async def finish_incremental(session: AsyncSession, delivery_date: date) -> bool:
+    await lock_dates(session, [delivery_date])
+    query = delete(assignment_progress).filter(assignment_progress.delivery_date == delivery_date). \
+        returning(assignment_progress.delivery_date)
+    if (await session.execute(query)).scalar() is None:
+        return False
+    for model in (courier_shifts, assignment_pending_orders, assignment_pending_couriers, assignment_skipped):
+        await session.execute(delete(model).filter(model.delivery_date == delivery_date))
+    return True
+
+
+# распределяем по сохраненным сменам заказы из очереди даты: новые и отложенные, которым есть смысл повторить
+# каждый вызов забирает только свою очередь, а не перебирает все заказы дня
+# поднимаются только смены регионов этих заказов
+async def assign_incremental(session: AsyncSession, delivery_date: date) -> List[dict]:
+    await lock_dates(session, [delivery_date])
+    query = select(assignment_progress).filter(assignment_progress.delivery_date == delivery_date).with_for_update()
+    result = await session.execute(query)
+    progress = result.scalar_one_or_none()
+    if progress is None:
+        query = select(orders_assignments.assignments_id).filter(orders_assignments.delivery_date == delivery_date)
+        if (await session.execute(query.exists().select())).scalar():
+            raise _mixed_modes_error(delivery_date, "На дату уже есть туры полного распределения")
+        await start_incremental(session, delivery_date)
+    else:
+        await retry_skipped(session, delivery_date, await add_pending_couriers(session, delivery_date))
+
+    query = delete(assignment_pending_orders).filter(assignment_pending_orders.delivery_date == delivery_date). \
+        returning(assignment_pending_orders.order_id)
+    order_ids = (await session.execute(query)).scalars().all()
+    if not order_ids:
+        return []
+    # заказ из очереди мог быть распределен на другую дату или выполнен
+    query = select(orders).filter(
+        orders.order_id.in_(order_ids),
+        orders.completed_time == None,
+        ~select(assignment_orders.order_id).filter(assignment_orders.order_id == orders.order_id).exists()
+    ).order_by(orders.order_id)
+    result = await session.execute(query)
+    orders_list = [OrderAssign(r) for r, in result]
+    if not orders_list:
+        return []
+
+    query = select(courier_shifts).filter(courier_shifts.delivery_date == delivery_date,
+                                          courier_shifts.is_loaded == False,
+                                          courier_shifts.regions.overlap(sorted({o.regions for o in orders_list}))). \
+        order_by(courier_shifts.shift_id)
+    result = await session.execute(query)
+    states = [r for r, in result]
+
+    turn_ids = [state.assignments_id for state in states if state.assignments_id is not None]
+    result = await session.execute(select(orders_assignments).filter(orders_assignments.assignments_id.in_(turn_ids)))
+    turns = {r.assignments_id: r for r, in result}
+
+    shifts = []
+    for state in states:
+        shift = CourierLoad(state, state.working_hours, delivery_date)
+        shift.restore(state, turns.get(state.assignments_id))
+        shifts.append(shift)
+
+    # смены дня подняты не все, поэтому туры смен, не взявших заказ, не перезапускаем
+    pool = CourierPool(shifts, restart_others=False)
+    skipped = [dict(delivery_date=delivery_date, order_id=order.order_id, regions=order.regions)
+               for order in orders_list if pool.assign(order) is None]
+    pool.drain()
+    if skipped:
+        await session.execute(insert(assignment_skipped), skipped)
+    # закрытый тур освобождает загрузку смены: отложенные заказы ее регионов попробуем в следующем вызове
+    loaded = {id(shift) for shift in pool.loaded}
+    await retry_skipped(session, delivery_date, {region for shift in shifts
+                                                 if shift.order_groups_list and id(shift) not in loaded
+                                                 for region in shift.regions})
+    for shift in pool.loaded:
+        shift.restart_turn()
+
+    new_ids = {order.order_id for order in orders_list}
+    changed = []
+    opened = []
+    saved = []
+    for state, shift in zip(states, shifts):
+        # туры, закрытые за этот вызов
+        for group in shift.order_groups_list:
+            changed.append((shift, group))
+            saved.append(_save_turn(session, shift, group, turns))
+
+        state.assignments_id = None
+        current = shift.current_turn
+        if current.orders:
+            current.turn_time = shift.start_time
+            if new_ids.intersection(current.orders):
+                changed.append((shift, current))
+                row = _save_turn(session, shift, current, turns)
+                saved.append(row)
+                opened.append((state, row))
+            else:
+                opened.append((state, turns[current.assignments_id]))
+
+        state.start_time = shift.start_time
+        state.available_load = shift.available_load
+        state.available_regions = shift.available_regions
+        state.available_orders = shift.available_orders
+        state.is_loaded = id(shift) in loaded
+
+    await session.flush()
+    for state, row in opened:
+        state.assignments_id = row.assignments_id
+    # в туры этого вызова добавились только новые заказы, остальные уже есть в assignment_orders
+    links = [dict(assignments_id=row.assignments_id, order_id=order_id, courier_id=row.courier_id,
+                  delivery_date=row.delivery_date)
+             for row in saved for order_id in row.orders if order_id in new_ids]
+    if links:
+        await session.execute(insert(assignment_orders), links)
+
+    return [dict(courier_id=shift.courier_id, courier_type=shift.courier_type, delivery_date=delivery_date,
+                 turn_time=minutes_to_time(group.turn_time), regions=list(group.regions), orders=list(group.orders))
+            for shift, group in changed]
+
+
+def _save_turn(session: AsyncSession, shift: CourierLoad, turn: CourierTurn, turns: dict) -> orders_assignments:
+    row = turns.get(turn.assignments_id)
+    if row is None:
+        row = orders_assignments(courier_id=shift.courier_id, courier_type=shift.courier_type,
+                                 delivery_date=shift.delivery_date)
+        session.add(row)
+    row.turn_time = minutes_to_time(turn.turn_time)
+    row.regions = list(turn.regions)
+    row.orders = list(turn.orders)
+    return row
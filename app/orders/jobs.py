@@ -0,0 +1,84 @@
+import asyncio
+import json
+from datetime import date
+from typing import Awaitable, Callable, Optional
+from uuid import uuid4
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from starlette import status
+
+from app.fastapi_limiter import FastAPILimiter
+from app.orders.schemas import JobStatus
+
+
+# фоновые задачи распределения заказов
+# состояние хранится в редисе (том же, что у лимитера), поэтому статус можно спросить у любого воркера,
+# а сама задача выполняется в процессе, который ее принял
+class AssignmentJobs:
+    prefix: str = "assign-job"
+    job_ttl: int = 24 * 60 * 60
+    # на случай падения воркера: блокировка даты не должна жить вечно
+    lock_ttl: int = 60 * 60
+    _tasks: set = set()
+
+    @classmethod
+    def _job_key(cls, job_id: str) -> str:
+        return f"{cls.prefix}:{job_id}"
+
+    @classmethod
+    def _lock_key(cls, delivery_date: date) -> str:
+        return f"{cls.prefix}:date:{delivery_date}"
+
+    @classmethod
+    async def _save(cls, job: dict):
+        await FastAPILimiter.redis.set(cls._job_key(job["job_id"]), json.dumps(jsonable_encoder(job)), ex=cls.job_ttl)
+
+    @classmethod
+    async def get(cls, job_id: str) -> Optional[dict]:
+        data = await FastAPILimiter.redis.get(cls._job_key(job_id))
+        return json.loads(data) if data is not None else None
+
+    # options - параметры расчета: повторный запуск на ту же дату получает идущую задачу, только если они совпадают,
+    # иначе 409 - две задачи на одну дату одновременно не считаются
+    @classmethod
+    async def submit(cls, delivery_date: date, options: dict, session_factory: Callable,
+                     runner: Callable[..., Awaitable[list]]) -> dict:
+        redis = FastAPILimiter.redis
+        job = {"job_id": uuid4().hex, "status": JobStatus.PENDING, "delivery_date": delivery_date, "options": options}
+        await cls._save(job)
+        if not await redis.set(cls._lock_key(delivery_date), job["job_id"], nx=True, ex=cls.lock_ttl):
+            # на эту дату задача уже идет
+            await redis.delete(cls._job_key(job["job_id"]))
+            running_id = await redis.get(cls._lock_key(delivery_date))
+            running = await cls.get(running_id) if running_id is not None else None
+            if running is None or running.get("options") != jsonable_encoder(options):
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail={
+                    "status": "error",
+                    "data": {"job_id": running_id, "delivery_date": str(delivery_date)},
+                    "details": "На дату уже идет задача распределения с другими параметрами"
+                })
+            return running
+
+        task = asyncio.create_task(cls._run(job, session_factory, runner))
+        cls._tasks.add(task)
+        task.add_done_callback(cls._tasks.discard)
+        return job
+
+    @classmethod
+    async def _run(cls, job: dict, session_factory: Callable, runner: Callable[..., Awaitable[list]]):
+        redis = FastAPILimiter.redis
+        try:
+            job["status"] = JobStatus.RUNNING
+            await cls._save(job)
+            async with session_factory() as session:
+                job["orders_assignment"] = await runner(session)
+            job["status"] = JobStatus.DONE
+        except Exception as error:
+            job["status"] = JobStatus.FAILED
+            job["details"] = repr(error)
+        finally:
+            await cls._save(job)
+            lock_key = cls._lock_key(job["delivery_date"])
+            if await redis.get(lock_key) == job["job_id"]:
+                await redis.delete(lock_key)
@@ -0,0 +1,63 @@
+from datetime import date
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import ROSTER_CACHE_MAX_SHIFTS
+from app.metrics import cache_metrics
+from app.models import CourierLoad, couriers
+
+
+# строки курьеров для распределения вместе с заготовками смен: смены на дату копируются с заготовок
+# заготовки строятся при первом расчете (в потоке или процессе расчета) и в другой процесс не передаются
+class Roster(list):
+    def __init__(self, rows=()):
+        super().__init__(rows)
+        self.templates: Optional[List[CourierLoad]] = None
+
+    def __reduce__(self):
+        return Roster, (list(self),)
+
+    def shifts(self, delivery_date: date) -> List[CourierLoad]:
+        templates = self.templates
+        if templates is None:
+            templates = self.templates = [CourierLoad(_courier, working_hours, None)
+                                          for _courier in self for working_hours in _courier.working_hours]
+        return [template.clone(delivery_date) for template in templates]
+
+
+# состав курьеров в памяти процесса, хранится только последняя версия
+# версия - счетчик, который увеличивают ручки добавления курьеров этого процесса, и max(courier_id) в бд,
+# который замечает курьеров, добавленных другими процессами (курьеры не меняются и не удаляются)
+class RosterCache:
+    def __init__(self, max_shifts: int = ROSTER_CACHE_MAX_SHIFTS):
+        self.max_shifts = max_shifts
+        self.version = 0
+        self.key: Optional[Tuple[int, Optional[int]]] = None
+        self.roster: Optional[Roster] = None
+
+    def invalidate(self):
+        self.version += 1
+
+    async def get(self, session: AsyncSession) -> Roster:
+        key = (self.version, (await session.execute(select(func.max(couriers.courier_id)))).scalar())
+        if self.roster is not None and self.key == key:
+            cache_metrics.hits["roster"] += 1
+            return self.roster
+        cache_metrics.misses["roster"] += 1
+
+        query = select(couriers.courier_id, couriers.courier_type, couriers.regions, couriers.working_hours)
+        result = await session.execute(query)
+        roster = Roster(result.fetchall())
+        shifts = sum(len(_courier.working_hours) for _courier in roster)
+        if shifts <= self.max_shifts:
+            self.key, self.roster = key, roster
+            cache_metrics.entries["roster"] = shifts
+        else:
+            self.key, self.roster = None, None
+            cache_metrics.entries["roster"] = 0
+        return roster
+
+
+roster_cache = RosterCache()
@@ -1,17 +1,37 @@
-from typing import List
+from datetime import date, timedelta
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select, func
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import select, insert, update, func, literal, column, Integer, String
+from sqlalchemy.dialects.postgresql import ARRAY, insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_async_session
+from app.bulk import bulk_insert, read_ndjson_chunks
+from app.cache import ReadThroughCache
+from app.config import MAX_IMPROVEMENT_BUDGET_MS
+from app.database import background_session, get_async_session, get_read_session
+from app.etag import ETag
+from app.export import ndjson_response
 from app.fastapi_limiter.depends import RateLimiter
-from app.models import orders, delivery, couriers, CourierLoad, OrderAssign, orders_assignments
+from app.models import orders, delivery, orders_assignments, assignment_orders, \
+    courier_daily_stats
+from app.orders.assignment import assign_parallel, plan_assignments, plan_range
+from app.orders.executor import run_planning
+from app.orders.incremental import assign_incremental, finish_incremental, reject_incremental_dates
+from app.pagination import next_cursor, paginate
+from app.singleflight import SingleFlight
+from app.orders.jobs import AssignmentJobs
+from app.orders.roster import roster_cache
 from app.orders.schemas import CreateOrderRequest, CompleteOrderRequestDto, OrderAssignmentRequest, \
-    OrderAssignmentRequestDev, OrderAssignmentResponse, CreateOrdersResponse
+    OrderAssignmentRequestDev, OrderAssignmentResponse, CreateOrdersResponse, AssignmentJobResponse, \
+    OrderAssignmentRangeRequest, CreateOrderDto, CreateOrdersBulkResponse
 from app.orders.schemas import OrderDTO
 from starlette import status
 
+order_cache = ReadThroughCache("order", OrderDTO)
+orders_flight = SingleFlight("orders")
+
 router = APIRouter(
     prefix="/orders",
     tags=["Orders"],
@@ -19,18 +39,38 @@ router = APIRouter(
 )
 
 
-# получение одного заказа
+# выгрузка заказов в NDJSON, можно отфильтровать по выполнению и по дате распределения
+@router.get(
+    "/export",
+    response_class=StreamingResponse,
+    name="Orders export"
+)
+async def export_orders(request: Request, completed: Optional[bool] = None, delivery_date: Optional[date] = None):
+    query = select(*orders.__table__.c)
+    if completed is not None:
+        query = query.filter(orders.completed_time.isnot(None) if completed else orders.completed_time == None)
+    if delivery_date is not None:
+        query = query.filter(select(assignment_orders.order_id).filter(assignment_orders.order_id == orders.order_id,
+                                                                       assignment_orders.delivery_date == delivery_date)
+                             .exists())
+    return ndjson_response(request.app, query, orders.order_id)
+
+
+# получение одного заказа, промах кеша читается из основной бд
 @router.get(
     "/{order_id}",
     response_model=OrderDTO
 )
 async def get_specific_order(order_id: int, session: AsyncSession = Depends(get_async_session)):
-    try:
+    async def load():
         query = select(orders).filter(orders.order_id == order_id)
         result = await session.execute(query)
         order_row = result.fetchone()
         if order_row is not None:
             return order_row[0]
+
+    try:
+        return await order_cache.get(order_id, load)
     except Exception:
         # Передать ошибку разработчикам
         raise HTTPException(status_code=500, detail={
@@ -40,15 +80,25 @@ async def get_specific_order(order_id: int, session: AsyncSession = Depends(get_
         })
 
 # получение списка заказов
+# ответ - список, поэтому курсор следующей страницы передается в заголовке X-Next-Cursor
 @router.get(
     "/",
     status_code=status.HTTP_200_OK,
-    response_model=List[OrderDTO]
+    response_model=List[OrderDTO],
+    dependencies=[Depends(ETag("orders"))]
 )
-async def get_orders(session: AsyncSession = Depends(get_async_session), offset: int = 0, limit: int = 1):
-    query = select(orders).limit(limit).offset(offset)
-    result = await session.execute(query)
-    return [r for r, in result]
+async def get_orders(response: Response, session: AsyncSession = Depends(get_read_session), offset: int = 0,
+                     limit: int = 1, cursor: Optional[str] = None):
+    async def load():
+        query = paginate(select(orders), orders.order_id, limit, offset, cursor)
+        result = await session.execute(query)
+        return [r for r, in result]
+
+    orders_data = await orders_flight.do((offset, limit, cursor), load)
+    cursor = next_cursor([o.order_id for o in orders_data], limit)
+    if cursor is not None:
+        response.headers["X-Next-Cursor"] = cursor
+    return orders_data
 
 
 # загрузка списка заказов
@@ -58,44 +108,81 @@ async def get_orders(session: AsyncSession = Depends(get_async_session), offset:
     response_model=CreateOrdersResponse
 )
 async def add_orders(new_orders: CreateOrderRequest, session: AsyncSession = Depends(get_async_session)):
-    orders_data = [orders(**i.dict()) for i in new_orders.orders]
-    session.add_all(orders_data)
+    orders_data = []
+    if new_orders.orders:
+        query = insert(orders.__table__).returning(*orders.__table__.c, sort_by_parameter_order=True)
+        result = await session.execute(query, [i.dict() for i in new_orders.orders])
+        orders_data = result.all()
     await session.commit()
+    await order_cache.invalidate(*(order.order_id for order in orders_data))
     return {"orders": orders_data}
 
 
+# массовая загрузка заказов: тело в формате NDJSON, по одному заказу CreateOrderDto на строку
+@router.post(
+    "/bulk",
+    status_code=status.HTTP_200_OK,
+    response_model=CreateOrdersBulkResponse
+)
+async def add_orders_bulk(request: Request, session: AsyncSession = Depends(get_async_session)):
+    order_ids = await bulk_insert(session, orders, orders.order_id, read_ndjson_chunks(request, CreateOrderDto))
+    await order_cache.invalidate_all()
+    # список ключей отдаем без проверки response_model, на сотнях тысяч строк она дороже самой загрузки
+    return JSONResponse({"order_ids": order_ids})
+
+
 # отметить выполнение заказа
 @router.post(
     "/complete",
     status_code=status.HTTP_200_OK
 )
 async def complete_order(request: CompleteOrderRequestDto, session: AsyncSession = Depends(get_async_session)):
+    # вся пачка одним запросом: заказ отмечается выполненным, только если он назначен на указанного курьера
+    # и еще не выполнен, для каждого элемента пачки возвращаем свой статус
+    items = func.unnest(
+        literal([each.order_id for each in request.complete_info], ARRAY(Integer)),
+        literal([each.courier_id for each in request.complete_info], ARRAY(Integer)),
+        literal([str(each.complete_time) for each in request.complete_info], ARRAY(String))
+    ).table_valued(column("order_id", Integer), column("courier_id", Integer), column("complete_time", String)). \
+        render_derived(name="items")
+    query = update(orders). \
+        filter(orders.order_id == items.c.order_id, orders.completed_time == None,
+               assignment_orders.order_id == items.c.order_id, assignment_orders.courier_id == items.c.courier_id). \
+        values(completed_time=items.c.complete_time). \
+        returning(orders.order_id, items.c.courier_id, assignment_orders.delivery_date, orders.cost)
+    query_result = await session.execute(query)
+    completed = set()
+    stats = {}
+    for order_id, courier_id, delivery_date, cost in query_result:
+        # заказ может быть в нескольких турах курьера на одну дату, учитываем его один раз
+        if (order_id, courier_id) in completed:
+            continue
+        completed.add((order_id, courier_id))
+        orders_count, orders_cost = stats.get((courier_id, delivery_date), (0, 0))
+        stats[courier_id, delivery_date] = (orders_count + 1, orders_cost + cost)
+    if stats:
+        # статистика курьера обновляется в той же транзакции, строки по порядку ключа против взаимных блокировок
+        query = pg_insert(courier_daily_stats).values([
+            dict(courier_id=courier_id, stat_date=stat_date, orders_count=orders_count, orders_cost=orders_cost)
+            for (courier_id, stat_date), (orders_count, orders_cost) in sorted(stats.items())
+        ])
+        query = query.on_conflict_do_update(
+            index_elements=[courier_daily_stats.courier_id, courier_daily_stats.stat_date],
+            set_=dict(orders_count=courier_daily_stats.orders_count + query.excluded.orders_count,
+                      orders_cost=courier_daily_stats.orders_cost + query.excluded.orders_cost)
+        )
+        await session.execute(query)
+    await session.commit()
+    await order_cache.invalidate(*(order_id for order_id, _ in completed))
+
     result = []
     for each in request.complete_info:
-        # старый код выборки
-        # query = select(orders).filter(
-        #     orders.order_id == select(delivery.order_id).filter(delivery.courier_id == each.courier_id,
-        #                                                         delivery.order_id == each.order_id).as_scalar()
-        # )
-
-        query = select(orders).filter(orders.completed_time == None, orders.order_id == each.order_id). \
-            filter(orders.order_id.in_(select(func.unnest(orders_assignments.orders)). \
-                                       filter(orders_assignments.courier_id == each.courier_id)
-                                          ))
-
-        query_result = await session.execute(query)
-        order_row = query_result.fetchone()
-        if order_row is not None:
-            order_row[0].completed_time = str(each.complete_time)
+        if (each.order_id, each.courier_id) in completed:
+            # повторы заказа в пачке считаем ошибкой: выполнен он только один раз
+            completed.discard((each.order_id, each.courier_id))
             result.append((each.order_id, status.HTTP_200_OK))
         else:
-            raise HTTPException(status_code=400, detail={
-            "status": "error",
-            "data": {"order_id": each.order_id, "courier_id": each.courier_id},
-            "details": "Неверные данные. Заказ не назначен на указанного курьера или уже выполнен"
-        })
-
-    await session.commit()
+            result.append((each.order_id, status.HTTP_400_BAD_REQUEST))
     return result
 
 # Старый метод использовался при выполнении 1го задания
@@ -110,56 +197,114 @@ async def complete_order(request: CompleteOrderRequestDto, session: AsyncSession
 #             "courier_id": delivery_data.courier_id, "delivery_date": delivery_data.delivery_date}
 
 
+# все курьеры (из кеша состава) и еще не распределенные заказы
+async def load_planning_rows(session: AsyncSession):
+    couriers_db = await roster_cache.get(session)
+
+    query = select(orders.order_id, orders.regions, orders.cost, orders.weight, orders.delivery_hours). \
+        filter(orders.completed_time == None). \
+        filter(~select(assignment_orders.order_id).filter(assignment_orders.order_id == orders.order_id).exists())
+    result = await session.execute(query)
+    orders_db = result.fetchall()
+    return couriers_db, orders_db
+
+
+# туры и их заказы построчно
+async def save_assignments(session: AsyncSession, rows: List[dict]):
+    if not rows:
+        return
+    query = insert(orders_assignments).returning(orders_assignments.assignments_id, sort_by_parameter_order=True)
+    result = await session.execute(query, rows)
+    await session.execute(insert(assignment_orders), [
+        dict(assignments_id=assignments_id, order_id=order_id, courier_id=row["courier_id"],
+             delivery_date=row["delivery_date"])
+        for assignments_id, row in zip(result.scalars(), rows) for order_id in row["orders"]
+    ])
+
+
+# распределение заказов на дату, общее для ручки и фоновых задач
+# budget_ms - время на улучшение жадного плана, в инкрементальном режиме не используется
+async def run_assignment(session: AsyncSession, request: OrderAssignmentRequestDev, budget_ms: int = 0) -> List[dict]:
+    if request.incremental:
+        result = await assign_incremental(session, request.delivery_date)
+        await session.commit()
+        await order_cache.invalidate_all()
+        return result
+
+    await reject_incremental_dates(session, [request.delivery_date])
+    couriers_db, orders_db = await load_planning_rows(session)
+
+    if request.parallel:
+        result = await assign_parallel(couriers_db, orders_db, request.delivery_date, prefilter=request.prefilter,
+                                       budget_ms=budget_ms)
+    else:
+        result = await run_planning(plan_assignments, couriers_db, orders_db, request.delivery_date,
+                                    request.prefilter, budget_ms)
+
+    await save_assignments(session, result)
+    await session.commit()
+    await order_cache.invalidate_all()
+    return result
+
+
 @router.post(
     "/assign",
     response_model=list[OrderAssignmentResponse],
     name="Orders assignment"
 )
-async def assign_order_dev(request: OrderAssignmentRequestDev, session: AsyncSession = Depends(get_async_session)):
+async def assign_order_dev(request: OrderAssignmentRequestDev,
+                           budget_ms: int = Query(0, ge=0, le=MAX_IMPROVEMENT_BUDGET_MS),
+                           session: AsyncSession = Depends(get_async_session)):
     try:
-        query = select(couriers)
-        result = await session.execute(query)
-        couriers_db = result.fetchall()
-        available_couriers = []
-        for _courier in couriers_db:
-            for working_hours in _courier[0].working_hours:
-                available_couriers.append(CourierLoad(_courier[0], working_hours, request.delivery_date))
+        return await run_assignment(session, request, budget_ms)
+    except HTTPException:
+        raise
+    except Exception:
+        # Передать ошибку разработчикам
+        raise HTTPException(status_code=500, detail={
+            "status": "resolved",
+            "data": None,
+            "details": "Нет данных для распределения"
+        })
 
 
-        query = select(orders).filter(orders.completed_time == None). \
-                                filter(orders.order_id.not_in(select(func.unnest(orders_assignments.orders))
-                                       ))
+# завершить инкрементальное распределение на дату: его туры остаются, а на дату снова можно запускать полное
+@router.delete(
+    "/assign/incremental/{delivery_date}",
+    name="Finish incremental assignment"
+)
+async def finish_incremental_assignment(delivery_date: date, session: AsyncSession = Depends(get_async_session)):
+    if not await finish_incremental(session, delivery_date):
+        raise HTTPException(status_code=404, detail={
+            "status": "error",
+            "data": {"delivery_date": str(delivery_date)},
+            "details": "На дату нет инкрементального распределения"
+        })
+    await session.commit()
+    return {"status": "success", "delivery_date": delivery_date}
 
-        result = await session.execute(query)
-        orders_db = result.fetchall()
-        loaded = []
-        for _order in orders_db:
-            order = OrderAssign(_order[0])
-            try:
-                courier = next(
-                    c for c in sorted(available_couriers) if c.can_allocate(order)
-                )
-                courier.allocate(order)
-            except:
-                # нет доступных курьеров
-                pass
-
-            if courier.is_loaded():
-                loaded.append(courier)
-                available_couriers.remove(courier)
-
-        loaded.extend(available_couriers)
-
-        result = []
-        for turn in loaded:
-            turn.restart_turn()
-            for group in turn.order_groups_list:
-                result.append(dict(courier_id=turn.courier_id, courier_type=turn.courier_type, delivery_date=turn.delivery_date, turn_time=group.turn_time,
-                                   regions=group.regions, orders=group.orders))
-
-        session.add_all([orders_assignments(**i) for i in result])
+
+# распределение на диапазон дат: курьеры и свободные заказы читаются один раз, все туры пишутся одной вставкой
+@router.post(
+    "/assign/range",
+    response_model=list[OrderAssignmentResponse],
+    name="Orders assignment for date range"
+)
+async def assign_order_range(request: OrderAssignmentRangeRequest, session: AsyncSession = Depends(get_async_session)):
+    try:
+        delivery_dates = [request.date_from + timedelta(days=i)
+                          for i in range((request.date_to - request.date_from).days + 1)]
+        await reject_incremental_dates(session, delivery_dates)
+        couriers_db, orders_db = await load_planning_rows(session)
+
+        result = await run_planning(plan_range, couriers_db, orders_db, delivery_dates, request.prefilter)
+
+        await save_assignments(session, result)
         await session.commit()
+        await order_cache.invalidate_all()
         return result
+    except HTTPException:
+        raise
     except Exception:
         # Передать ошибку разработчикам
         raise HTTPException(status_code=500, detail={
@@ -169,3 +314,33 @@ async def assign_order_dev(request: OrderAssignmentRequestDev, session: AsyncSes
         })
 
 
+# запуск распределения в фоне, повторный запуск на ту же дату с теми же параметрами возвращает уже идущую задачу
+@router.post(
+    "/assign/jobs",
+    status_code=status.HTTP_202_ACCEPTED,
+    response_model=AssignmentJobResponse,
+    name="Orders assignment job"
+)
+async def submit_assignment_job(request: OrderAssignmentRequestDev, http_request: Request,
+                                budget_ms: int = Query(0, ge=0, le=MAX_IMPROVEMENT_BUDGET_MS)):
+    return await AssignmentJobs.submit(
+        request.delivery_date,
+        dict(request.dict(exclude={"delivery_date"}), budget_ms=budget_ms),
+        lambda: background_session(http_request.app),
+        lambda session: run_assignment(session, request, budget_ms)
+    )
+
+
+@router.get(
+    "/assign/jobs/{job_id}",
+    response_model=AssignmentJobResponse
+)
+async def get_assignment_job(job_id: str):
+    job = await AssignmentJobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail={
+            "status": "error",
+            "data": {"job_id": job_id},
+            "details": "Задача не найдена"
+        })
+    return job
@@ -1,3 +1,4 @@
+from enum import Enum
 from typing import List, Optional
 from datetime import datetime as pydate
 
@@ -7,6 +8,9 @@ from pydantic.schema import datetime, date, time
 
 from app.models import hours_pattern
 
+# максимальная длина диапазона дат для распределения за один вызов
+MAX_ASSIGN_DAYS = 31
+
 
 class OurBaseModel(BaseModel):
     class Config:
@@ -46,6 +50,10 @@ class CreateOrderRequest(BaseModel):
     orders: List[CreateOrderDto]
 
 
+class CreateOrdersBulkResponse(BaseModel):
+    order_ids: List[int]
+
+
 class CompleteOrder(BaseModel):
     complete_time: datetime = pydate.now().strftime("%Y-%m-%d %H:%M")
     courier_id: int
@@ -63,6 +71,29 @@ class OrderAssignmentRequest(BaseModel):
 
 class OrderAssignmentRequestDev(BaseModel):
     delivery_date: Optional[date] = pydate.today().strftime("%Y-%m-%d")
+    # предварительно отсечь невозможные пары заказ-смена на numpy (requirements-prefilter.txt), на результат
+    # распределения не влияет, без numpy не применяется
+    prefilter: bool = False
+    # распределить независимые группы регионов в пуле процессов
+    parallel: bool = False
+    # дописать новые заказы в сохраненные смены дня вместо полного пересчета
+    incremental: bool = False
+
+
+class OrderAssignmentRangeRequest(BaseModel):
+    date_from: date
+    date_to: date
+    prefilter: bool = False
+
+    @validator("date_to")
+    def validate_date_to(cls, value, values):
+        date_from = values.get("date_from")
+        if date_from is not None and not 0 <= (value - date_from).days < MAX_ASSIGN_DAYS:
+            raise HTTPException(
+                status_code=422,
+                detail=f"date_to должна быть не раньше date_from, диапазон не длиннее {MAX_ASSIGN_DAYS} дней"
+            )
+        return value
 
 
 class OrderAssignmentResponse(OurBaseModel):
@@ -72,3 +103,18 @@ class OrderAssignmentResponse(OurBaseModel):
     turn_time: time
     regions: List[int]
     orders: List[int]
+
+
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class AssignmentJobResponse(BaseModel):
+    job_id: str
+    status: JobStatus
+    delivery_date: date
+    orders_assignment: Optional[List[OrderAssignmentResponse]]
+    details: Optional[str]
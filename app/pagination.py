@@ -0,0 +1,42 @@
+import base64
+import binascii
+import json
+from typing import List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import Column, Select
+
+
+# курсор - закодированный ключ последней отданной строки, клиент передает его обратно без изменений
+def encode_cursor(key: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"after": key}).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))["after"]
+        if type(key) is not int:
+            raise ValueError
+        return key
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail={
+            "status": "error",
+            "data": {"cursor": cursor},
+            "details": "Неверный курсор"
+        })
+
+
+# с курсором страница начинается сразу после ключа и не зависит от глубины,
+# без курсора работает прежний offset; в обоих случаях строки упорядочены по ключу
+def paginate(query: Select, key: Column, limit: int, offset: int, cursor: Optional[str]) -> Select:
+    query = query.order_by(key).limit(limit)
+    if cursor is not None:
+        return query.filter(key > decode_cursor(cursor))
+    return query.offset(offset)
+
+
+# курсор следующей страницы, если текущая заполнена целиком
+def next_cursor(keys: List[int], limit: int) -> Optional[str]:
+    if keys and len(keys) >= limit:
+        return encode_cursor(keys[-1])
+    return None
@@ -1,8 +1,21 @@
 from fastapi import APIRouter, Request, Depends
+from fastapi.responses import PlainTextResponse
 from starlette import status
 
+from app.database import engine
 from app.fastapi_limiter.depends import RateLimiter
+from app.metrics import render
 
 router = APIRouter(
     dependencies=[Depends(RateLimiter(times=10, seconds=1))]
 )
+
+
+# состояние пула соединений с бд и кеша подготовленных запросов в формате prometheus
+@router.get(
+    "/metrics",
+    status_code=status.HTTP_200_OK,
+    response_class=PlainTextResponse
+)
+async def get_metrics():
+    return render(engine)
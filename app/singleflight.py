@@ -0,0 +1,51 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+from app.config import SINGLE_FLIGHT
+from app.metrics import single_flight_metrics
+
+T = TypeVar("T")
+
+
+# объединение одинаковых одновременных чтений в процессе: пока первый запрос с ключом читает бд,
+# остальные с тем же ключом ждут его результат и свою сессию не используют
+# результат общий, поэтому его нельзя менять; ошибка первого запроса достается всем ожидающим,
+# а при отмене первого запроса ожидающие читают сами
+# ключ должен включать все, от чего зависит результат (параметры запроса, а при появлении авторизации - и ее область)
+# выключенный (по умолчанию, см. SINGLE_FLIGHT) просто вызывает load
+class SingleFlight:
+    def __init__(self, name: str, enabled: bool = SINGLE_FLIGHT):
+        self.name = name
+        self.enabled = enabled
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, load: Callable[[], Awaitable[T]]) -> T:
+        if not self.enabled:
+            return await load()
+        future = self.calls.get(key)
+        if future is not None:
+            single_flight_metrics.coalesced[self.name] += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                return await self.do(key, load)
+
+        single_flight_metrics.calls[self.name] += 1
+        future = asyncio.get_running_loop().create_future()
+        self.calls[key] = future
+        try:
+            result = await load()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            future.exception()  # без ожидающих ошибка не должна попасть в лог как необработанная
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self.calls[key]
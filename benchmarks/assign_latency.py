@@ -0,0 +1,94 @@
+# задержка GET /couriers/{id} во время распределения заказов при разных способах выполнения плана
+# нужны бд и редис из app/config.py, данные создаются и удаляются скриптом
+# запуск: python -m benchmarks.assign_latency --couriers 2000 --orders 20000
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from datetime import date
+
+import redis.asyncio as redisac
+from httpx import AsyncClient
+from sqlalchemy import delete, insert
+
+from app.config import REDIS_HOST
+from app.database import async_session_maker, engine
+from app.fastapi_limiter import FastAPILimiter
+from app.main import app
+from app.models import Base, couriers, orders, orders_assignments
+from app.orders import executor
+
+DELIVERY_DATE = date(2000, 1, 1)
+
+
+async def seed(count_couriers: int, count_orders: int):
+    rnd = random.Random(1)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with async_session_maker() as session:
+        result = await session.execute(insert(couriers).returning(couriers.courier_id), [
+            dict(courier_type=rnd.choice(["FOOT", "BIKE", "AUTO"]), regions=rnd.sample(range(1, 201), 2),
+                 working_hours=[f"{h:02}:00-{h + 4:02}:00" for h in [rnd.randint(7, 15)]])
+            for _ in range(count_couriers)
+        ])
+        courier_ids = list(result.scalars())
+        await session.execute(insert(orders), [
+            dict(weight=rnd.choice([1, 3, 5, 10]), regions=rnd.randint(1, 200), cost=rnd.randint(50, 500),
+                 delivery_hours=[f"{h:02}:00-{h + 2:02}:00" for h in [rnd.randint(8, 20)]])
+            for _ in range(count_orders)
+        ])
+        await session.commit()
+    return courier_ids
+
+
+async def probe(client: AsyncClient, courier_ids, stop: asyncio.Event, latencies: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get(f"/couriers/{random.choice(courier_ids)}")
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.005)
+
+
+async def run(mode: str, courier_ids) -> dict:
+    executor.PLANNING_EXECUTOR = mode
+    latencies = []
+    stop = asyncio.Event()
+    async with AsyncClient(app=app, base_url="http://bench") as client:
+        probing = asyncio.create_task(probe(client, courier_ids, stop, latencies))
+        started = time.perf_counter()
+        response = await client.post("/orders/assign", json={"delivery_date": str(DELIVERY_DATE)})
+        assign_time = time.perf_counter() - started
+        stop.set()
+        await probing
+    async with async_session_maker() as session:
+        await session.execute(delete(orders_assignments).filter(orders_assignments.delivery_date == DELIVERY_DATE))
+        await session.commit()
+    latencies.sort()
+    return {
+        "mode": mode,
+        "status": response.status_code,
+        "assign_s": round(assign_time, 2),
+        "probes": len(latencies),
+        "p50_ms": round(statistics.median(latencies), 1),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 1),
+        "max_ms": round(latencies[-1], 1),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--couriers", type=int, default=2000)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--modes", nargs="+", default=["inline", "thread", "process"])
+    args = parser.parse_args()
+
+    await FastAPILimiter.init(redisac.from_url(f"redis://{REDIS_HOST}", encoding="utf-8", decode_responses=True))
+    courier_ids = await seed(args.couriers, args.orders)
+    for mode in args.modes:
+        print(await run(mode, courier_ids))
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+# бенчмарк алгоритма распределения заказов в памяти, без бд
+# на каждый размер: заказов в секунду, пиковая память расчета (tracemalloc) и качество плана
+# результаты пишутся в json, второй прогон с --compare покажет регрессии относительно сохраненного
+# запуск: python -m benchmarks.assignment --sizes 1000 10000 100000 1000000 --output bench.json
+import argparse
+import gc
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime
+
+from app.orders.assignment import plan_assignments
+from benchmarks.data import make_couriers, make_orders
+
+DELIVERY_DATE = date(2023, 5, 15)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_case(size: int, args) -> dict:
+    # курьеров в --ratio раз меньше, чем заказов, регионов - так, чтобы на регион приходилось около 50 курьеров
+    count_couriers = max(1, size // args.ratio)
+    regions = max(1, count_couriers // 50)
+    courier_rows = make_couriers(random.Random(args.seed), count_couriers, regions,
+                                 types_mix=args.types_mix, max_regions=args.max_regions)
+    order_rows = make_orders(random.Random(args.seed), size, regions)
+
+    def plan():
+        return plan_assignments(courier_rows, order_rows, DELIVERY_DATE, args.prefilter, args.budget_ms)
+
+    timings = []
+    for _ in range(args.repeat):
+        gc.collect()
+        started = time.perf_counter()
+        rows = plan()
+        timings.append(time.perf_counter() - started)
+    best = min(timings)
+
+    peak_mb = None
+    if not args.no_memory:
+        gc.collect()
+        tracemalloc.start()
+        plan()
+        peak_mb = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+
+    cost = {_order.order_id: _order.cost for _order in order_rows}
+    assigned = [order_id for row in rows for order_id in row["orders"]]
+    return {
+        "orders": size,
+        "couriers": count_couriers,
+        "regions": regions,
+        "seconds": round(best, 4),
+        "orders_per_sec": round(size / best),
+        "peak_mb": peak_mb,
+        "turns": len(rows),
+        "assigned": len(assigned),
+        "total_cost": sum(cost[order_id] for order_id in assigned),
+    }
+
+
+# падение скорости больше допуска или любое изменение плана считаем регрессией
+def compare(baseline: dict, current: dict, tolerance: float) -> bool:
+    ok = True
+    previous = {case["orders"]: case for case in baseline["cases"]}
+    for case in current["cases"]:
+        base = previous.get(case["orders"])
+        if base is None:
+            continue
+        speed = case["orders_per_sec"] / base["orders_per_sec"]
+        quality = (case["assigned"], case["total_cost"]) == (base["assigned"], base["total_cost"])
+        regression = speed < 1 - tolerance or not quality
+        ok &= not regression
+        print(f"{case['orders']:>9} orders: speed x{speed:.2f}, "
+              f"assigned {base['assigned']} -> {case['assigned']}, cost {base['total_cost']} -> {case['total_cost']}"
+              f"{'  REGRESSION' if regression else ''}", file=sys.stderr)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--ratio", type=int, default=10, help="заказов на одного курьера")
+    parser.add_argument("--types-mix", type=float, nargs=3, default=[1, 1, 1], metavar=("FOOT", "BIKE", "AUTO"))
+    parser.add_argument("--max-regions", type=int, default=3)
+    parser.add_argument("--prefilter", action="store_true")
+    parser.add_argument("--budget-ms", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="не замерять память, прогон под tracemalloc медленнее")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="файл для результатов, по умолчанию stdout")
+    parser.add_argument("--compare", help="сохраненные результаты для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимое падение скорости")
+    args = parser.parse_args()
+
+    result = {
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "tolerance")},
+        "cases": [],
+    }
+    for size in args.sizes:
+        case = run_case(size, args)
+        print(case, file=sys.stderr)
+        result["cases"].append(case)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if {key: value for key, value in baseline.get("params", {}).items() if key not in ("sizes", "repeat")} != \
+                {key: value for key, value in result["params"].items() if key not in ("sizes", "repeat")}:
+            print("параметры прогонов отличаются, сравнение может быть некорректным", file=sys.stderr)
+        if not compare(baseline, result, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
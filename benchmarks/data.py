@@ -0,0 +1,65 @@
+# синтетические курьеры и заказы для бенчмарков
+# строки повторяют колонки, которые ручки распределения читают из бд, поэтому их можно отдавать прямо в plan_assignments
+import random
+from datetime import date
+from typing import List, NamedTuple, Sequence
+
+from app.models import CourierLoad, OrderAssign
+from app.orders.assignment import build_shifts
+
+
+class CourierRow(NamedTuple):
+    courier_id: int
+    courier_type: str
+    regions: List[int]
+    working_hours: List[str]
+
+
+class OrderRow(NamedTuple):
+    order_id: int
+    regions: int
+    cost: int
+    weight: float
+    delivery_hours: List[str]
+
+
+COURIER_TYPES = ("FOOT", "BIKE", "AUTO")
+WEIGHTS = (1, 2, 5, 8, 15, 30, 50)
+
+
+# types_mix - доли FOOT, BIKE и AUTO
+# second_shift - доля курьеров со второй, вечерней сменой
+def make_couriers(rnd: random.Random, count: int, regions: int, types_mix: Sequence[float] = (1, 1, 1),
+                  max_regions: int = 3, second_shift: float = 0.3) -> List[CourierRow]:
+    result = []
+    for courier_id in range(1, count + 1):
+        start = rnd.randint(7, 16)
+        working_hours = [f"{start:02}:00-{start + rnd.randint(2, 5):02}:00"]
+        if rnd.random() < second_shift:
+            working_hours.append(f"{start + 6:02}:00-{start + 7:02}:30")
+        result.append(CourierRow(courier_id, rnd.choices(COURIER_TYPES, types_mix)[0],
+                                 rnd.sample(range(1, regions + 1), rnd.randint(1, min(max_regions, regions))),
+                                 working_hours))
+    return result
+
+
+# часть заказов (около 10%) приходит в регионы, где нет курьеров
+def make_orders(rnd: random.Random, count: int, regions: int, weights: Sequence[float] = WEIGHTS,
+                max_window: int = 3) -> List[OrderRow]:
+    result = []
+    for order_id in range(1, count + 1):
+        start = rnd.randint(8, 21)
+        result.append(OrderRow(order_id, rnd.randint(1, regions + regions // 10), rnd.randint(50, 1000),
+                               rnd.choice(weights),
+                               [f"{start:02}:00-{min(start + rnd.randint(1, max_window), 23):02}:00"]))
+    return result
+
+
+# те же данные в том виде, в котором их принимает assign_orders
+def make_shifts(rnd: random.Random, count: int, regions: int, delivery_date: date = date(2023, 5, 15),
+                **options) -> List[CourierLoad]:
+    return build_shifts(make_couriers(rnd, count, regions, **options), delivery_date)
+
+
+def make_order_list(rnd: random.Random, count: int, regions: int, **options) -> List[OrderAssign]:
+    return [OrderAssign(_order) for _order in make_orders(rnd, count, regions, **options)]
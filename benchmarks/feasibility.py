@@ -0,0 +1,47 @@
+# сравнение проверки пар заказ-смена на python и матрицы допустимости на numpy
+# запуск: python -m benchmarks.feasibility --couriers 10000 --orders 100000
+import argparse
+import random
+import time
+
+from app.orders.assignment import assign_orders, build_assignments
+from app.orders.feasibility import feasibility_mask
+from benchmarks.data import make_order_list, make_shifts
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--couriers", type=int, default=10000)
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--regions", type=int, default=200)
+    parser.add_argument("--sample", type=int, default=200, help="заказов для оценки проверки пар на python")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    shifts = make_shifts(random.Random(args.seed), args.couriers, args.regions)
+    orders_list = make_order_list(random.Random(args.seed), args.orders, args.regions)
+    print(f"shifts: {len(shifts)}, orders: {len(orders_list)}")
+
+    sample = orders_list[:args.sample]
+    python_time, _ = timed(lambda: [[shift.can_serve(order) for shift in shifts] for order in sample])
+    python_time *= len(orders_list) / len(sample)
+    numpy_time, _ = timed(lambda: sum(int(block.sum()) for _, block in feasibility_mask(shifts, orders_list)))
+    print(f"mask, python per pair (extrapolated): {python_time:.2f}s")
+    print(f"mask, numpy: {numpy_time:.2f}s, speedup x{python_time / numpy_time:.1f}")
+
+    plain_shifts = make_shifts(random.Random(args.seed), args.couriers, args.regions)
+    plain_time, plain = timed(lambda: assign_orders(plain_shifts, orders_list))
+    filtered_shifts = make_shifts(random.Random(args.seed), args.couriers, args.regions)
+    filtered_time, filtered = timed(lambda: assign_orders(filtered_shifts, orders_list, prefilter=True))
+    print(f"assign: {plain_time:.2f}s, with prefilter: {filtered_time:.2f}s")
+    assert build_assignments(plain) == build_assignments(filtered)
+
+
+if __name__ == "__main__":
+    main()
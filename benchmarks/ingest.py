@@ -0,0 +1,80 @@
+# скорость загрузки заказов: orm add_all (как раньше было в POST /orders), POST /orders и POST /orders/bulk (NDJSON)
+# нужны бд и редис из app/config.py, созданные заказы удаляются скриптом
+# запуск: python -m benchmarks.ingest --orders 100000
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Tuple
+
+import redis.asyncio as redisac
+from httpx import AsyncClient
+from sqlalchemy import delete, func, select
+
+from app.config import REDIS_HOST
+from app.database import async_session_maker, engine
+from app.fastapi_limiter import FastAPILimiter
+from app.main import app
+from app.models import Base, orders
+from benchmarks.data import make_orders
+
+
+def payload(count: int):
+    return [dict(weight=row.weight, regions=row.regions, cost=row.cost, delivery_hours=row.delivery_hours)
+            for row in make_orders(random.Random(1), count, 200)]
+
+
+async def orm_add_all(items) -> Tuple[int, float]:
+    started = time.perf_counter()
+    async with async_session_maker() as session:
+        orders_data = [orders(**item) for item in items]
+        session.add_all(orders_data)
+        await session.commit()
+        return len([_order.order_id for _order in orders_data]), time.perf_counter() - started
+
+
+async def post_json(client: AsyncClient, items) -> Tuple[int, float]:
+    content = json.dumps({"orders": items}).encode()
+    started = time.perf_counter()
+    response = await client.post("/orders/", content=content, headers={"Content-Type": "application/json"})
+    return len(response.json()["orders"]), time.perf_counter() - started
+
+
+async def post_bulk(client: AsyncClient, items) -> Tuple[int, float]:
+    lines = [json.dumps(item) + "\n" for item in items]
+    chunks = ["".join(lines[i:i + 1000]).encode() for i in range(0, len(lines), 1000)]
+
+    async def body():
+        for chunk in chunks:
+            yield chunk
+
+    started = time.perf_counter()
+    response = await client.post("/orders/bulk", content=body(), headers={"Content-Type": "application/x-ndjson"})
+    return len(response.json()["order_ids"]), time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=100000)
+    args = parser.parse_args()
+
+    await FastAPILimiter.init(redisac.from_url(f"redis://{REDIS_HOST}", encoding="utf-8", decode_responses=True))
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    items = payload(args.orders)
+    async with AsyncClient(app=app, base_url="http://bench", timeout=None) as client:
+        for name, load in [("orm add_all", lambda: orm_add_all(items)), ("POST /orders", lambda: post_json(client, items)),
+                           ("POST /orders/bulk", lambda: post_bulk(client, items))]:
+            async with async_session_maker() as session:
+                last_id = (await session.execute(select(func.max(orders.order_id)))).scalar() or 0
+            # тело запроса готовится заранее, время считается только на стороне сервиса
+            count, seconds = await load()
+            print({"mode": name, "rows": count, "seconds": round(seconds, 2), "rows_per_sec": round(count / seconds)})
+            async with async_session_maker() as session:
+                await session.execute(delete(orders).filter(orders.order_id > last_id))
+                await session.commit()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
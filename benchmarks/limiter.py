@@ -0,0 +1,57 @@
+# стоимость вычисления ключа лимитера на один запрос в зависимости от числа маршрутов приложения:
+# поиск по всем маршрутам (как было) и индексы, запомненные для маршрута
+# бд и редис не нужны
+# запуск: python -m benchmarks.limiter --routes 10 100 1000
+import argparse
+import time
+
+from fastapi import APIRouter, Depends, FastAPI
+from starlette.requests import Request
+
+from app.fastapi_limiter.depends import RateLimiter
+
+
+def make_app(count: int):
+    limiter = RateLimiter(times=10, seconds=1)
+    router = APIRouter(dependencies=[Depends(limiter)])
+    for i in range(count):
+        router.add_api_route(f"/items{i}/{{item_id}}", lambda item_id: item_id, methods=["GET"])
+    app = FastAPI()
+    app.include_router(router)
+    return app, limiter
+
+
+# запрос к последнему маршруту - худший случай для поиска
+def make_request(app: FastAPI, count: int) -> Request:
+    path = f"/items{count - 1}/1"
+    route = next(route for route in app.routes if getattr(route, "path", None) == f"/items{count - 1}/{{item_id}}")
+    return Request({"type": "http", "method": "GET", "path": path, "headers": [], "app": app, "route": route})
+
+
+def measure(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        best = min(best, (time.perf_counter() - started) / repeat)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--routes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    for count in args.routes:
+        app, limiter = make_app(count)
+        request = make_request(app, count)
+        assert limiter._route_key(request) == (len(app.routes) - 1, 0)
+        scan = measure(lambda: limiter._scan(request), args.repeat)
+        memoized = measure(lambda: limiter._route_key(request), args.repeat)
+        print({"routes": count, "scan_us": round(scan * 1e6, 2), "memoized_us": round(memoized * 1e6, 2)})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""skip table version setting
+
+Revision ID: f1b6c8e2a4d7
+Revises: d4a9f0c3e6b1
+Create Date: 2026-10-18 21:14:37.208615
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'f1b6c8e2a4d7'
+down_revision = 'd4a9f0c3e6b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("""
+        CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+        BEGIN
+            IF current_setting('app.skip_table_version', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            INSERT INTO table_versions (table_name, version) VALUES (TG_TABLE_NAME, 1)
+            ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO table_versions (table_name, version) VALUES (TG_TABLE_NAME, 1)
+            ON CONFLICT (table_name) DO UPDATE SET version = table_versions.version + 1;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
@@ -0,0 +1,149 @@
+import pickle
+import random
+from datetime import date, time, timedelta
+
+import pytest
+
+from app.models import couriers, orders, CourierLoad, OrderAssign, parse_hours
+from app.orders import feasibility, improvement
+from app.orders.assignment import assign_orders, assign_partition, build_assignments, partition, plan_assignments, \
+    plan_range
+from app.orders.roster import Roster
+from benchmarks.data import make_couriers, make_order_list, make_orders, make_shifts
+
+
+# распределение в том виде, в котором оно было в ручке assign_order_dev до индекса смен
+# единственное отличие: заказ, который не взяла ни одна смена, пропускается, а не роняет запрос
+def assign_orders_baseline(available_couriers, orders_list):
+    loaded = []
+    for order in orders_list:
+        try:
+            courier = next(
+                c for c in sorted(available_couriers) if c.can_allocate(order)
+            )
+            courier.allocate(order)
+        except StopIteration:
+            # нет доступных курьеров
+            continue
+
+        if courier.is_loaded():
+            loaded.append(courier)
+            available_couriers.remove(courier)
+
+    loaded.extend(available_couriers)
+    return loaded
+
+
+def test_pool_matches_baseline_greedy():
+    for seed in range(50):
+        expected = build_assignments(assign_orders_baseline(make_shifts(random.Random(seed), 30, 5),
+                                                            make_order_list(random.Random(seed), 200, 5)))
+        actual = build_assignments(assign_orders(make_shifts(random.Random(seed), 30, 5),
+                                                 make_order_list(random.Random(seed), 200, 5)))
+        assert actual == expected
+
+
+@pytest.mark.skipif(feasibility.load_numpy() is None, reason="numpy is not installed")
+def test_prefilter_keeps_result():
+    for seed in range(10):
+        expected = build_assignments(assign_orders(make_shifts(random.Random(seed), 30, 5),
+                                                   make_order_list(random.Random(seed), 200, 5)))
+        actual = build_assignments(assign_orders(make_shifts(random.Random(seed), 30, 5),
+                                                 make_order_list(random.Random(seed), 200, 5), prefilter=True))
+        assert actual == expected
+
+
+def test_partitions_split_by_regions():
+    for seed in range(10):
+        shifts = make_shifts(random.Random(seed), 30, 12, max_regions=1)
+        orders_list = make_order_list(random.Random(seed), 200, 12)
+        parts = partition(shifts, orders_list, 3)
+        assert len(parts) == 3
+
+        # смены и заказы одного региона попадают в одну часть, заказы без курьеров отбрасываются
+        part_regions = [{region for shift in part_shifts for region in shift.regions} for part_shifts, _ in parts]
+        for i, (part_shifts, part_orders) in enumerate(parts):
+            assert {order.regions for order in part_orders} <= part_regions[i]
+            assert all(part_regions[i].isdisjoint(part_regions[j]) for j in range(i))
+        assert sorted(id(shift) for part_shifts, _ in parts for shift in part_shifts) == sorted(map(id, shifts))
+        served = set().union(*part_regions)
+        assert sorted(order.order_id for _, part_orders in parts for order in part_orders) == \
+            [order.order_id for order in orders_list if order.regions in served]
+
+        rows = [row for part_shifts, part_orders in parts for row in assign_partition(part_shifts, part_orders)]
+        orders_ids = [order_id for row in rows for order_id in row["orders"]]
+        assert orders_ids and len(orders_ids) == len(set(orders_ids))
+
+
+def test_turn_time_converted_at_response():
+    courier = couriers(courier_id=1, courier_type="BIKE", regions=[1], working_hours=["9:30-12:00"])
+    order = orders(order_id=1, weight=5, regions=1, cost=100, delivery_hours=["09:00-21:00"])
+    assert parse_hours("9:30-12:00") == (570, 720)
+    result = build_assignments(assign_orders([CourierLoad(courier, "9:30-12:00", date(2023, 5, 15))],
+                                             [OrderAssign(order)]))
+    assert result[0]["turn_time"] == time(9, 42)
+
+
+def test_range_carries_unassigned_orders():
+    courier_rows = make_couriers(random.Random(1), 10, 3, types_mix=(1, 0, 0), max_regions=1, second_shift=0)
+    order_rows = make_orders(random.Random(1), 300, 3, weights=(1, 3, 5))
+    dates = [date(2023, 5, 15) + timedelta(days=i) for i in range(5)]
+
+    expected = []
+    pending = order_rows
+    for delivery_date in dates:
+        rows = plan_assignments(courier_rows, pending, delivery_date)
+        assigned = {order_id for row in rows for order_id in row["orders"]}
+        pending = [_order for _order in pending if _order.order_id not in assigned]
+        expected.extend(rows)
+
+    result = plan_range(courier_rows, order_rows, dates)
+    assert result == expected
+    assert len({row["delivery_date"] for row in result}) > 1
+    orders_ids = [order_id for row in result for order_id in row["orders"]]
+    assert len(orders_ids) == len(set(orders_ids))
+
+
+def test_roster_templates_keep_result():
+    courier_rows = make_couriers(random.Random(2), 30, 5, second_shift=1)
+    order_rows = make_orders(random.Random(2), 300, 5)
+    dates = [date(2023, 5, 15), date(2023, 5, 16)]
+
+    roster = Roster(courier_rows)
+    # заготовки смен переиспользуются между расчетами и не меняются ими
+    for _ in range(2):
+        assert plan_range(roster, order_rows, dates) == plan_range(courier_rows, order_rows, dates)
+        assert plan_assignments(roster, order_rows, dates[0]) == plan_assignments(courier_rows, order_rows, dates[0])
+    assert roster.templates is not None
+    assert pickle.loads(pickle.dumps(roster)).templates is None
+
+
+def test_improvement_never_worse_than_greedy():
+    def stats(rows, orders_list):
+        cost = {order.order_id: order.cost for order in orders_list}
+        orders_ids = [order_id for row in rows for order_id in row["orders"]]
+        assert len(orders_ids) == len(set(orders_ids))
+        return len(orders_ids), sum(cost[order_id] for order_id in orders_ids)
+
+    improved = False
+    for seed in range(10):
+        orders_list = make_order_list(random.Random(seed), 200, 5)
+        greedy = assign_partition(make_shifts(random.Random(seed), 30, 5), orders_list)
+        shifts = {(shift.courier_id, shift.working_hours): shift for shift in make_shifts(random.Random(seed), 30, 5)}
+        result = improvement.improve(assign_orders(list(shifts.values()), orders_list), orders_list, 1000)
+
+        assert stats(result, orders_list) >= stats(greedy, orders_list)
+        improved |= stats(result, orders_list) > stats(greedy, orders_list)
+        by_id = {order.order_id: order for order in orders_list}
+        for row in result:
+            shift = next(shift for shift in shifts.values() if shift.courier_id == row["courier_id"])
+            assert len(row["orders"]) <= shift.max_orders
+            assert sum(by_id[order_id].weight for order_id in row["orders"]) <= shift.max_load
+            assert len(row["regions"]) <= shift.max_regions and set(row["regions"]) <= set(shift.regions)
+    assert improved
+
+
+def test_improvement_with_zero_budget_keeps_greedy_plan():
+    orders_list = make_order_list(random.Random(0), 200, 5)
+    expected = assign_partition(make_shifts(random.Random(0), 30, 5), orders_list)
+    assert improvement.improve(assign_orders(make_shifts(random.Random(0), 30, 5), orders_list), orders_list, 0) == expected
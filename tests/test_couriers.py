@@ -1,4 +1,10 @@
 from httpx import AsyncClient
+from sqlalchemy import text, update
+
+from app.bulk import bulk_insert
+from app.etag import get_table_versions
+from app.models import couriers
+from tests.conftest import async_session_maker
 
 
 async def test_add_couriers(async_client: AsyncClient):
@@ -42,4 +48,108 @@ async def test_get_couriers(async_client: AsyncClient):
 
     assert response.status_code == 200
     print(response.json())
-    assert len(response.json()) == 3
\ No newline at end of file
+    assert len(response.json()["couriers"]) == 3
+
+async def test_add_couriers_bulk(async_client: AsyncClient):
+    content = "\n".join([
+        '{"courier_type": "FOOT", "regions": [7], "working_hours": ["08:00-10:00"]}',
+        '',
+        '{"courier_type": "AUTO", "regions": [7, 8]}'
+    ])
+    response = await async_client.post("/couriers/bulk", content=content,
+                                       headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    courier_ids = response.json()["courier_ids"]
+    assert len(courier_ids) == 2
+
+    response = await async_client.get(f"/couriers/{courier_ids[1]}")
+    assert response.json()["working_hours"] == ["11:00-15:00"]
+
+    response = await async_client.post("/couriers/bulk", content='{"courier_type": "FOOT", "regions": [7]}\n'
+                                                                 '{"courier_type": "BOAT", "regions": [7]}\n')
+    assert response.status_code == 422
+    assert response.json()["detail"]["data"] == {"line": 2}
+
+
+async def test_get_couriers_cursor(async_client: AsyncClient):
+    response = await async_client.get("/couriers/", params={"limit": 100})
+    expected = [courier["courier_id"] for courier in response.json()["couriers"]]
+
+    courier_ids = []
+    params = {"limit": 2}
+    while True:
+        response = await async_client.get("/couriers/", params=params)
+        assert response.status_code == 200
+        courier_ids += [courier["courier_id"] for courier in response.json()["couriers"]]
+        if response.json()["next_cursor"] is None:
+            break
+        params["cursor"] = response.json()["next_cursor"]
+    assert courier_ids == expected
+
+    response = await async_client.get("/couriers/", params={"limit": 2, "cursor": "broken"})
+    assert response.status_code == 400
+
+
+async def test_get_couriers_etag(async_client: AsyncClient):
+    response = await async_client.get("/couriers/", params={"limit": 100})
+    etag = response.headers["ETag"]
+    response = await async_client.get("/couriers/", params={"limit": 100}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    # другая страница - другой ETag
+    response = await async_client.get("/couriers/", params={"limit": 1}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+
+    response = await async_client.post("/couriers/", json={
+        "couriers": [{"courier_type": "FOOT", "regions": [9], "working_hours": ["10:00-12:00"]}]
+    })
+    assert response.status_code == 200
+    response = await async_client.get("/couriers/", params={"limit": 100}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+async def test_bulk_insert_table_version():
+    row = {"courier_type": "FOOT", "regions": [9], "working_hours": []}
+
+    async def chunks():
+        yield [row]
+        yield [row]
+        # первая пачка уже записана, но строка счетчика версии до commit загрузки не заблокирована
+        async with async_session_maker() as other:
+            await other.execute(text("SET LOCAL lock_timeout = '1s'"))
+            other.add(couriers(**row))
+            await other.commit()
+        yield [row]
+
+    async with async_session_maker() as session:
+        version, = await get_table_versions(session, ("couriers",))
+        await session.commit()
+        assert len(await bulk_insert(session, couriers, couriers.courier_id, chunks())) == 3
+        # загрузка увеличивает версию один раз
+        assert await get_table_versions(session, ("couriers",)) == (version + 2,)
+
+
+async def test_table_version_changed_rows():
+    async with async_session_maker() as session:
+        version, = await get_table_versions(session, ("couriers",))
+        # оператор, не изменивший строк, версию не увеличивает
+        await session.execute(update(couriers).filter(couriers.courier_id == -1).values(regions=[1]))
+        await session.commit()
+        assert await get_table_versions(session, ("couriers",)) == (version,)
+
+        # несколько операторов одной транзакции - одно увеличение, видимое после commit
+        session.add(couriers(courier_type="FOOT", regions=[9], working_hours=[]))
+        await session.flush()
+        await session.execute(update(couriers).filter(couriers.courier_id == -1).values(regions=[1]))
+        session.add(couriers(courier_type="FOOT", regions=[9], working_hours=[]))
+        await session.flush()
+        async with async_session_maker() as other:
+            assert await get_table_versions(other, ("couriers",)) == (version,)
+            other.add(couriers(courier_type="FOOT", regions=[9], working_hours=[]))
+            await other.execute(text("SET LOCAL lock_timeout = '1s'"))
+            await other.commit()
+        await session.commit()
+        assert await get_table_versions(session, ("couriers",)) == (version + 2,)
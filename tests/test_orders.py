@@ -1,4 +1,17 @@
+import asyncio
+import json
+from contextlib import nullcontext
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
 from httpx import AsyncClient
+from sqlalchemy import func, select
+
+from app.metrics import cache_metrics
+from app.models import orders, assignment_pending_orders, assignment_skipped, courier_shifts
+from app.orders.jobs import AssignmentJobs
+from tests.conftest import async_session_maker
 
 
 async def test_add_orders(async_client: AsyncClient):
@@ -31,4 +44,363 @@ async def test_get_orders(async_client: AsyncClient):
 
     assert response.status_code == 200
     print(response.json())
-    assert len(response.json()) == 2
\ No newline at end of file
+    assert len(response.json()) == 2
+
+
+async def test_get_orders_cursor(async_client: AsyncClient):
+    response = await async_client.get("/orders/", params={"limit": 1})
+    assert response.status_code == 200
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = await async_client.get("/orders/", params={"limit": 1, "cursor": cursor})
+    assert [order["order_id"] for order in response.json()] == [2]
+
+    response = await async_client.get("/orders/", params={"limit": 1, "cursor": response.headers["X-Next-Cursor"]})
+    assert response.json() == []
+    assert "X-Next-Cursor" not in response.headers
+
+
+async def test_assign_orders_incremental(async_client: AsyncClient):
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-05-20", "incremental": True})
+    assert response.status_code == 200
+    assert sorted(order for turn in response.json() for order in turn["orders"]) == [1, 2]
+
+    response = await async_client.post("/orders/", json={
+        "orders": [
+            {
+                "weight": 5,
+                "regions": 1,
+                "delivery_hours": [
+                    "09:00-21:00"
+                ],
+                "cost": 50
+            }
+        ]
+    })
+    assert response.status_code == 200
+
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-05-20", "incremental": True})
+    assert response.status_code == 200
+    print(response.json())
+    assert len(response.json()) == 1
+    assert response.json()[0]["orders"] == [1, 2, 3]
+
+
+async def test_assign_orders(async_client: AsyncClient):
+    response = await async_client.post("/orders/", json={
+        "orders": [
+            {
+                "weight": 3,
+                "regions": 2,
+                "delivery_hours": [
+                    "17:00-19:00"
+                ],
+                "cost": 70
+            }
+        ]
+    })
+    assert response.status_code == 200
+
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-05-21"})
+    assert response.status_code == 200
+    print(response.json())
+    assert [turn["orders"] for turn in response.json()] == [[4]]
+
+    response = await async_client.post("/orders/assign", params={"budget_ms": -1}, json={"delivery_date": "2023-05-21"})
+    assert response.status_code == 422
+
+
+async def test_assign_orders_job(async_client: AsyncClient):
+    response = await async_client.post("/orders/", json={
+        "orders": [
+            {
+                "weight": 3,
+                "regions": 1,
+                "delivery_hours": [
+                    "10:00-12:00"
+                ],
+                "cost": 70
+            }
+        ]
+    })
+    assert response.status_code == 200
+
+    response = await async_client.post("/orders/assign/jobs", json={"delivery_date": "2023-05-22"})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    for _ in range(50):
+        response = await async_client.get(f"/orders/assign/jobs/{job_id}")
+        assert response.status_code == 200
+        if response.json()["status"] in ("done", "failed"):
+            break
+        await asyncio.sleep(0.1)
+    assert response.json()["status"] == "done"
+    assert [turn["orders"] for turn in response.json()["orders_assignment"]] == [[5]]
+
+    response = await async_client.get("/orders/assign/jobs/unknown")
+    assert response.status_code == 404
+    response = await async_client.post("/orders/assign/jobs", params={"budget_ms": -1},
+                                       json={"delivery_date": "2023-05-22"})
+    assert response.status_code == 422
+
+
+async def test_assign_job_options(async_client: AsyncClient):
+    release = asyncio.Event()
+
+    async def runner(session):
+        await release.wait()
+        return []
+
+    delivery_date = date(2023, 6, 10)
+    options = {"incremental": False, "parallel": False, "prefilter": False, "budget_ms": 100}
+    job = await AssignmentJobs.submit(delivery_date, options, nullcontext, runner)
+    # те же параметры - та же задача, другие - 409 с номером идущей
+    assert (await AssignmentJobs.submit(delivery_date, dict(options), nullcontext, runner))["job_id"] == job["job_id"]
+    with pytest.raises(HTTPException) as error:
+        await AssignmentJobs.submit(delivery_date, dict(options, budget_ms=0), nullcontext, runner)
+    assert error.value.status_code == 409
+    assert error.value.detail["data"]["job_id"] == job["job_id"]
+
+    release.set()
+    await asyncio.gather(*AssignmentJobs._tasks)
+    assert (await AssignmentJobs.get(job["job_id"]))["status"] == "done"
+    assert (await AssignmentJobs.submit(delivery_date, dict(options, budget_ms=0), nullcontext, runner))["job_id"] != \
+        job["job_id"]
+    await asyncio.gather(*AssignmentJobs._tasks)
+
+
+async def test_assign_orders_range(async_client: AsyncClient):
+    response = await async_client.post("/orders/", json={
+        "orders": [
+            {
+                "weight": 3,
+                "regions": 1,
+                "delivery_hours": [
+                    "10:00-12:00"
+                ],
+                "cost": 70
+            }
+        ]
+    })
+    assert response.status_code == 200
+
+    response = await async_client.post("/orders/assign/range", json={"date_from": "2023-05-24", "date_to": "2023-05-23"})
+    assert response.status_code == 422
+
+    response = await async_client.post("/orders/assign/range", json={"date_from": "2023-05-23", "date_to": "2023-05-29"})
+    assert response.status_code == 200
+    assert [(turn["delivery_date"], turn["orders"]) for turn in response.json()] == [("2023-05-23", [6])]
+
+
+async def test_complete_order(async_client: AsyncClient):
+    response = await async_client.get("/couriers/assignments/", params={"limit": 100})
+    assert response.status_code == 200
+    turn = next(turn for turn in response.json()["orders_assignment"] if 6 in turn["orders"])
+
+    complete_info = {"courier_id": turn["courier_id"], "order_id": 6, "complete_time": "2023-05-23 12:00"}
+    wrong_courier = dict(complete_info, courier_id=turn["courier_id"] + 100)
+    unknown_order = dict(complete_info, order_id=1000)
+    response = await async_client.post("/orders/complete", json={
+        "complete_info": [wrong_courier, complete_info, complete_info, unknown_order]
+    })
+    assert response.status_code == 200
+    assert response.json() == [[6, 400], [6, 200], [6, 400], [1000, 400]]
+
+    response = await async_client.post("/orders/complete", json={"complete_info": [complete_info]})
+    assert response.json() == [[6, 400]]
+
+    response = await async_client.get(f"/couriers/meta-info/{turn['courier_id']}",
+                                      params={"start_date": "2023-05-01", "end_date": "2023-06-01"})
+    assert response.status_code == 200
+    assert response.json()["orders_count"] == 1
+    assert response.json()["orders_cost"] == 70
+
+    # статистика берется только за запрошенный период
+    response = await async_client.get(f"/couriers/meta-info/{turn['courier_id']}",
+                                      params={"start_date": "2023-05-24", "end_date": "2023-06-01"})
+    assert response.status_code == 200
+    assert response.json().get("orders_count") is None
+
+
+async def test_export_orders(async_client: AsyncClient):
+    response = await async_client.get("/orders/export")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    exported = [json.loads(line) for line in response.text.splitlines()]
+    response = await async_client.get("/orders/", params={"limit": 1000})
+    assert [order["order_id"] for order in exported] == [order["order_id"] for order in response.json()]
+
+    response = await async_client.get("/orders/export", params={"completed": True})
+    assert [json.loads(line)["order_id"] for line in response.text.splitlines()] == [6]
+
+    response = await async_client.get("/couriers/assignments/export", params={"delivery_date": "2023-05-23"})
+    assert [json.loads(line)["orders"] for line in response.text.splitlines()] == [[6]]
+
+
+async def test_couriers_leaderboard(async_client: AsyncClient):
+    period = {"start_date": "2023-05-01", "end_date": "2023-06-01"}
+    response = await async_client.get("/couriers/leaderboard", params=period)
+    assert response.status_code == 200
+    leaderboard = response.json()["couriers"]
+    response = await async_client.get("/couriers/", params={"limit": 100})
+    assert len(leaderboard) == len(response.json()["couriers"])
+
+    # у единственного курьера с выполненным заказом те же цифры, что и в meta-info
+    leader = leaderboard[0]
+    assert leader["orders_count"] == 1
+    assert all(courier["rating"] is None for courier in leaderboard[1:])
+    response = await async_client.get(f"/couriers/meta-info/{leader['courier_id']}", params=period)
+    meta_info = response.json()
+    assert {key: leader[key] for key in meta_info if key in leader} == \
+        {key: meta_info[key] for key in meta_info if key in leader}
+
+    response = await async_client.get("/couriers/leaderboard", params=dict(period, sort_by="earnings", limit=1))
+    assert [courier["courier_id"] for courier in response.json()["couriers"]] == [leader["courier_id"]]
+
+    others = [courier["courier_id"] for courier in leaderboard[1:3]]
+    response = await async_client.get("/couriers/leaderboard", params=dict(period, courier_ids=others))
+    assert [courier["courier_id"] for courier in response.json()["couriers"]] == sorted(others)
+
+
+async def test_get_order_cache(async_client: AsyncClient):
+    hits = cache_metrics.hits["order"]
+    response = await async_client.get("/orders/6")
+    assert response.status_code == 200
+    assert (await async_client.get("/orders/6")).json() == response.json()
+    assert cache_metrics.hits["order"] == hits + 1
+
+    # после распределения и выполнения заказ читается заново
+    response = await async_client.post("/orders/", json={
+        "orders": [{"weight": 1, "regions": 1, "delivery_hours": ["10:00-12:00"], "cost": 10}]
+    })
+    order_id = response.json()["orders"][0]["order_id"]
+    assert (await async_client.get(f"/orders/{order_id}")).json()["completed_time"] is None
+
+    response = await async_client.post("/orders/assign/range", json={"date_from": "2023-05-24", "date_to": "2023-05-24"})
+    turn = next(turn for turn in response.json() if order_id in turn["orders"])
+    misses = cache_metrics.misses["order"]
+    assert (await async_client.get(f"/orders/{order_id}")).json()["completed_time"] is None
+    assert cache_metrics.misses["order"] == misses + 1
+
+    response = await async_client.post("/orders/complete", json={"complete_info": [
+        {"courier_id": turn["courier_id"], "order_id": order_id, "complete_time": "2023-05-24 11:00"}
+    ]})
+    assert response.json() == [[order_id, 200]]
+    assert (await async_client.get(f"/orders/{order_id}")).json()["completed_time"] is not None
+
+
+async def test_assign_roster_cache(async_client: AsyncClient):
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-06-02"})
+    assert response.status_code == 200
+    hits, misses = cache_metrics.hits["roster"], cache_metrics.misses["roster"]
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-06-02"})
+    assert response.status_code == 200
+    assert (cache_metrics.hits["roster"], cache_metrics.misses["roster"]) == (hits + 1, misses)
+
+    # новый курьер меняет версию состава
+    response = await async_client.post("/couriers/", json={
+        "couriers": [{"courier_type": "BIKE", "regions": [9], "working_hours": ["10:00-12:00"]}]
+    })
+    assert response.status_code == 200
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-06-02"})
+    assert response.status_code == 200
+    assert cache_metrics.misses["roster"] == misses + 1
+
+
+async def test_assign_incremental_out_of_order(async_client: AsyncClient):
+    new_order = {"weight": 1, "regions": 9, "delivery_hours": ["10:00-12:00"], "cost": 100}
+    async with async_session_maker() as session:
+        # ключ взят раньше, а заказ зафиксирован позже следующего, как при массовой загрузке
+        query = select(func.nextval(func.pg_get_serial_sequence("orders", "order_id")))
+        order_id = (await session.execute(query)).scalar()
+        response = await async_client.post("/orders/", json={"orders": [new_order]})
+        later_id = response.json()["orders"][0]["order_id"]
+        response = await async_client.post("/orders/assign", json={"delivery_date": "2023-06-05", "incremental": True})
+        assert response.status_code == 200
+        assigned = {order for turn in response.json() for order in turn["orders"]}
+        assert later_id in assigned and order_id not in assigned
+
+        session.add(orders(order_id=order_id, **new_order))
+        await session.commit()
+
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-06-05", "incremental": True})
+    assert response.status_code == 200
+    assert order_id in {order for turn in response.json() for order in turn["orders"]}
+
+    # режимы распределения на одну дату не смешиваются
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-06-05"})
+    assert response.status_code == 409
+    response = await async_client.post("/orders/assign/range", json={"date_from": "2023-06-04", "date_to": "2023-06-06"})
+    assert response.status_code == 409
+    assert response.json()["detail"]["data"] == {"delivery_date": "2023-06-05"}
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-05-21", "incremental": True})
+    assert response.status_code == 409
+
+
+async def test_assign_incremental_queue(async_client: AsyncClient):
+    # в регионе пока нет курьеров, заказ откладывается
+    response = await async_client.post("/orders/", json={
+        "orders": [{"weight": 1, "regions": 31, "delivery_hours": ["10:00-12:00"], "cost": 100}]
+    })
+    order_id = response.json()["orders"][0]["order_id"]
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-06-08", "incremental": True})
+    assert response.status_code == 200
+    assert order_id not in {order for turn in response.json() for order in turn["orders"]}
+    async with async_session_maker() as session:
+        query = select(assignment_skipped.regions).filter(assignment_skipped.order_id == order_id)
+        assert (await session.execute(query)).scalars().all() == [31]
+        query = select(func.count()).select_from(assignment_pending_orders). \
+            filter(assignment_pending_orders.delivery_date == date(2023, 6, 8))
+        assert (await session.execute(query)).scalar() == 0
+        # новый заказ стоит в очередях дат, распределение на которые уже идет
+        query = select(assignment_pending_orders.delivery_date).filter(assignment_pending_orders.order_id == order_id)
+        assert date(2023, 5, 20) in (await session.execute(query)).scalars().all()
+
+    # очередь пуста, повторный вызов ничего не перебирает
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-06-08", "incremental": True})
+    assert response.json() == []
+
+    # курьер, добавленный после начала распределения на дату, получает смену, отложенный заказ его региона повторяется
+    response = await async_client.post("/couriers/", json={
+        "couriers": [{"courier_type": "FOOT", "regions": [31], "working_hours": ["10:00-12:00"]}]
+    })
+    courier_id = response.json()["couriers"][0]["courier_id"]
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-06-08", "incremental": True})
+    assert [(turn["courier_id"], turn["orders"]) for turn in response.json()] == [(courier_id, [order_id])]
+
+    # после завершения инкрементального распределения на дату можно запустить полное
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-06-08"})
+    assert response.status_code == 409
+    response = await async_client.delete("/orders/assign/incremental/2023-06-08")
+    assert response.status_code == 200
+    response = await async_client.delete("/orders/assign/incremental/2023-06-08")
+    assert response.status_code == 404
+    async with async_session_maker() as session:
+        query = select(func.count()).select_from(courier_shifts).filter(courier_shifts.delivery_date == date(2023, 6, 8))
+        assert (await session.execute(query)).scalar() == 0
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-06-08"})
+    assert response.status_code == 200
+
+
+async def test_assign_incremental_retries_after_turn_closes(async_client: AsyncClient):
+    response = await async_client.post("/couriers/", json={
+        "couriers": [{"courier_type": "FOOT", "regions": [32, 33], "working_hours": ["10:00-14:00"]}]
+    })
+    courier_id = response.json()["couriers"][0]["courier_id"]
+    response = await async_client.post("/orders/", json={"orders": [
+        {"weight": 1, "regions": 32, "delivery_hours": ["10:00-14:00"], "cost": 100},
+        {"weight": 1, "regions": 33, "delivery_hours": ["10:00-10:40"], "cost": 100},
+        {"weight": 1, "regions": 32, "delivery_hours": ["10:00-14:00"], "cost": 100},
+    ]})
+    first, second, third = [order["order_id"] for order in response.json()["orders"]]
+
+    # в открытом туре пешего курьера нет места под второй регион, заказ откладывается,
+    # а третий заказ закрывает тур
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-06-09", "incremental": True})
+    turns = [turn["orders"] for turn in response.json() if turn["courier_id"] == courier_id]
+    assert turns == [[first, third]]
+
+    # тур закрыт, отложенный заказ его регионов повторяется в следующем вызове
+    response = await async_client.post("/orders/assign", json={"delivery_date": "2023-06-09", "incremental": True})
+    assert [(turn["courier_id"], turn["orders"]) for turn in response.json()] == [(courier_id, [second])]